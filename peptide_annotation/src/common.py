@@ -3,21 +3,12 @@
 # accessed by the stable protein ID or accession in case of artificial identifier
 # all_proteins[proteinID] = {'tag': tag, 'accession': accession, 'description': description, 'sequence': sequence}
 def read_fasta(filename):
-    proteinDB_file = open(filename, 'r')
-
-    # read protein db
-    metadata = proteinDB_file.readline()    # line starting with '>'
-    sequence = ""                           # all the other lines are considered protein sequences (considering also a multi-line format)
+    proteinDB_file = open(filename, 'rb')
 
     all_proteins = {}
 
     # read the reference sequence database
-    while metadata != "":
-
-        line = proteinDB_file.readline()
-        while not line.startswith('>') and not line == "":
-            sequence += line[:-1]
-            line = proteinDB_file.readline()
+    for metadata, sequence in iter_fasta(proteinDB_file):
 
         tag = ''
         accession = ''
@@ -65,9 +56,6 @@ def read_fasta(filename):
 
         all_proteins[proteinID] = {'tag': tag, 'accession': accession, 'description': description.replace('\n', ''), 'sequence': sequence, 'seq_positions': seq_positions, 'matching_proteins': matching_proteins, 'reading_frames': reading_frames}
 
-        metadata = line
-        sequence = ""
-
     proteinDB_file.close()
 
     return all_proteins
@@ -75,16 +63,13 @@ def read_fasta(filename):
 # returns an object containing all the protein metadata in the fasta file, 
 # accessed by the stable protein ID or accession in case of artificial identifier
 def read_fasta_metadata(filename):
-    proteinDB_file = open(filename, 'r')
+    proteinDB_file = open(filename, 'rb')
 
-    # read protein db
-    line = proteinDB_file.readline()
+    # read protein db, headers only
     all_proteins = {}
 
-    while line != '':
-        if (not line.startswith('>')):
-            line = proteinDB_file.readline()  
-        else:
+    for line, _ in iter_fasta(proteinDB_file, headers_only=True):
+        if line.startswith('>'):
             tag = ''
             accession = ''
             description = ''
@@ -114,11 +99,66 @@ def read_fasta_metadata(filename):
             proteinID = accession.split('.')[0]
             all_proteins[proteinID] = {'tag': tag, 'accession': accession, 'description': description.replace('\n', '')}
 
-            line = proteinDB_file.readline()
-
     proteinDB_file.close()
     return all_proteins
 
+# size of the blocks in which FASTA files are read
+FASTA_CHUNK_SIZE = 1 << 24
+
+# Iterates through the entries of a FASTA file (opened in binary mode), reading it in large blocks.
+# Every line starting with '>' starts a new entry, all the other lines are considered sequence (considering also a multi-line format).
+# yields: header line as in the file (including the leading '>' and the line break) and the sequence (None if headers_only is set),
+# the header is not parsed here -> callers parse only the entries they need
+def iter_fasta(fasta_file, headers_only = False):
+    pending = []        # blocks read but not processed yet, starting with a header line
+
+    while True:
+        chunk = fasta_file.read(FASTA_CHUNK_SIZE)
+        if chunk == b'':
+            break
+
+        # only complete entries are processed -> cut the block at the start of its last header line
+        cut = chunk.rfind(b'\n>') + 1
+        if (cut == 0) and not (chunk.startswith(b'>') and (len(pending) > 0) and pending[-1].endswith(b'\n')):
+            pending.append(chunk)
+            continue
+
+        yield from parse_fasta_block(b''.join(pending) + chunk[:cut], headers_only)
+        pending = [chunk[cut:]]
+
+    if len(pending) > 0:
+        yield from parse_fasta_block(b''.join(pending), headers_only)
+
+# split a block of complete FASTA entries, see iter_fasta
+def parse_fasta_block(block, headers_only):
+    if len(block) == 0:
+        return
+
+    if b'\r' in block:
+        block = block.replace(b'\r\n', b'\n')
+
+    entries = block.split(b'\n>')
+    for i, entry in enumerate(entries):
+        if i > 0:
+            entry = b'>' + entry
+        if i < len(entries) - 1:
+            entry += b'\n'
+
+        header_end = entry.find(b'\n') + 1
+        if header_end == 0:
+            header_end = len(entry)
+
+        if headers_only:
+            yield entry[:header_end].decode(), None
+            continue
+
+        # the last character of every line is removed, i.e., the line breaks
+        sequence = entry[header_end:]
+        if (len(sequence) > 0) and not sequence.endswith(b'\n'):
+            sequence = sequence[:-1]
+
+        yield entry[:header_end].decode(), sequence.replace(b'\n', b'').decode()
+
 def get_protein_name_dict(fasta_file):
     all_proteins = read_fasta(fasta_file)
     name_dict = {}
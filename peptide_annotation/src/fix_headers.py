@@ -1,5 +1,6 @@
 import argparse
 import os.path
+from common import iter_fasta
 
 parser = argparse.ArgumentParser(description='Format the protein headers as follows: >generic[your tag]|[protein accession]|[protein description]. Creates a single-line fasta.')
 
@@ -7,7 +8,7 @@ def is_valid_file(parser, arg):
     if not os.path.exists(arg):
         parser.error("The file %s does not exist!" % arg)
     else:
-        return open(arg, 'r')  # return an open file handle
+        return open(arg, 'rb')  # return an open file handle
 
 parser.add_argument("-i", dest="input_file", required=True,
                     help="input FASTA file", metavar="FILE",
@@ -29,16 +30,9 @@ print('')
 print("Reading file", args.input_file.name)
 print("Formatting protein headers.")
 
-metadata = args.input_file.readline()   # line starting with '>'
-sequence = ""                           # all the other lines are considered protein sequences (considering also a multi-line format)
 variant_count = 0		        # counter used to create unique identifiers for variants
 
-while metadata != "":
-
-    line = args.input_file.readline()
-    while not line.startswith('>') and not line == "":
-        sequence += line[:-1]
-        line = args.input_file.readline()
+for metadata, sequence in iter_fasta(args.input_file):
 
     tag = ''
     accession = ''
@@ -90,10 +84,7 @@ while metadata != "":
     if sequence.endswith('\n'): 
         args.output_file.write(sequence)    
     else:    
-        args.output_file.write(sequence + '\n')    
-
-    metadata = line
-    sequence = ""
+        args.output_file.write(sequence + '\n')
 
 args.output_file.close()
 args.input_file.close()
@@ -1,7 +1,7 @@
 import argparse
 import pandas as pd
 import re
-import vcf
+from modules.vcf_record import VCFTokenizer
 
 parser = argparse.ArgumentParser(description="Splits a VCF into separate files for each chromosome, fills in missing values by '-'.")
 
@@ -15,18 +15,15 @@ args = parser.parse_args()
 
 # if (not re.match(r'[CGTA]', str(ALT)))
 
-infile = open(args.input_file, 'r')
-vcf_reader = vcf.Reader(infile)
+infile = open(args.input_file, 'rb')
 vcf_data = []
 
 def fill_missing_seq(alt):
-    try:
-        if (not re.match(r'[CGTA]', str(alt.sequence))):
-            return '-'
-        else:
-            return alt.sequence
-    except:
+    # symbolic alleles (e.g., <DEL>) and breakends are replaced as well
+    if (not re.match(r'[CGTA]', alt)) or ('<' in alt) or ('[' in alt) or (']' in alt):
         return '-'
+    else:
+        return alt
 
 def fill_missing_str(allele):
     if (not re.match(r'[CGTA]', str(allele))):
@@ -34,19 +31,32 @@ def fill_missing_str(allele):
     else:
         return allele
 
-for record in vcf_reader:
-    for i,alt in enumerate(record.ALT):        
+# read the header, the last line holds the column names
+line = next(infile, b'')
+header_line = b''
+while line.startswith(b'#'):
+    header_line = line
+    line = next(infile, b'')
+
+tokenizer = VCFTokenizer.from_header_line(header_line)
+
+while line != b'':
+    record = tokenizer.parse(line)
+
+    AFs = record.info_value('AF')
+    if AFs is None:
+        AFs = record.info_value('MAF')
+    if AFs is not None:
+        AFs = AFs.split(',')
+
+    for i,alt in enumerate(record.alt.split(',')):
         MAF = -1
-        if ('AF' in record.INFO):
-            MAF = record.INFO['AF'][i]
-        elif ('MAF' in record.INFO):
-            MAF = record.INFO['MAF'][i]
+        if (AFs is not None) and (AFs[min(i, len(AFs) - 1)] != '.'):
+            MAF = float(AFs[min(i, len(AFs) - 1)])
 
-        ID = '.'
-        if record.ID is not None:
-            ID = record.ID
+        vcf_data.append([record.chrom.replace('chr', ''), record.pos, record.id, fill_missing_str(record.ref), fill_missing_seq(alt), ('MAF=' + str(MAF)) if MAF >= 0 else "."])
 
-        vcf_data.append([record.CHROM.replace('chr', ''), record.POS, ID, fill_missing_str(record.REF), fill_missing_seq(alt), ('MAF=' + str(MAF)) if MAF >= 0 else "."])
+    line = next(infile, b'')
 
 df = pd.DataFrame(data=vcf_data, columns=['#CHROM','POS','ID','REF','ALT','INFO'])
 CHROMOSOMES = [str(x) for x in list(range(1, 23))] + ['X', 'Y']
@@ -56,4 +66,4 @@ for chr in CHROMOSOMES:
 	df_chrom = df_chrom.sort_values(by='POS')
 	df_chrom.to_csv(args.output_file_prefix + '_chr' + chr + '.vcf', sep='\t', index=False, header=True)
 
-infile.close()
\ No newline at end of file
+infile.close()
@@ -0,0 +1,12 @@
+from modules.fasta_index import build_fasta_index, fasta_index_file
+import argparse
+
+parser = argparse.ArgumentParser(description='Builds the offset index of a FASTA file for random access to its entries (stored as <FASTA file>.offsets.npy).')
+
+parser.add_argument("-i", dest="input_file", required=True,
+                    help="input FASTA file", metavar="FILE")
+
+args = parser.parse_args()
+
+offsets = build_fasta_index(args.input_file)
+print('Indexed', len(offsets), 'entries of', args.input_file, 'in', fasta_index_file(args.input_file))
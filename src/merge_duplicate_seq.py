@@ -1,5 +1,4 @@
-from modules.common import read_fasta, KeyWrapper
-import bisect
+from modules.common import read_fasta, SequenceRegistry
 import argparse
 
 parser = argparse.ArgumentParser(
@@ -18,11 +17,10 @@ args = parser.parse_args()
 
 all_proteins = read_fasta(args.input_file)
 
-result_proteins = []
+result_proteins = SequenceRegistry()
 
 for protein in all_proteins.values():
     seq = protein["sequence"]
-    seq_hash = hash(seq)
 
     if ("hap" in protein["tag"]) or ("var" in protein["tag"]):
         matching_proteins = (
@@ -71,37 +69,21 @@ for protein in all_proteins.values():
         protein_start = "0"
         seq_position = "0"
 
-    nearest_idx = bisect.bisect_left(
-        KeyWrapper(result_proteins, key=lambda x: x["hash"]), seq_hash
+    result_proteins.add(
+        seq,
+        {
+            "matching_proteins": matching_proteins,
+            "split_sequences": protein["accession"],
+            "tags": protein["tag"],
+            "start": protein_start,
+            "seq_position": seq_position,
+            "rfs": rfs,
+        },
     )
-    if (
-        len(result_proteins) > nearest_idx
-        and result_proteins[nearest_idx]["hash"] == seq_hash
-    ):
-        result_proteins[nearest_idx]["matching_proteins"].append(matching_proteins)
-        result_proteins[nearest_idx]["rfs"].append(rfs)
-        result_proteins[nearest_idx]["split_sequences"].append(protein["accession"])
-        result_proteins[nearest_idx]["tags"].append(protein["tag"])
-        result_proteins[nearest_idx]["start"].append(protein_start)
-        result_proteins[nearest_idx]["seq_position"].append(seq_position)
-    else:
-        result_proteins.insert(
-            nearest_idx,
-            {
-                "hash": seq_hash,
-                "matching_proteins": [matching_proteins],
-                "split_sequences": [protein["accession"]],
-                "tags": [protein["tag"]],
-                "sequence": seq,
-                "start": [protein_start],
-                "seq_position": [seq_position],
-                "rfs": [rfs],
-            },
-        )
 
 outfile = open(args.output_file, "w")
 
-for i, protein in enumerate(result_proteins):
+for i, protein in enumerate(result_proteins.values()):
     matching_proteins = [",".join(plist) for plist in protein["matching_proteins"]]
     rfs = [",".join(rflist) for rflist in protein["rfs"]]
     description = (
@@ -0,0 +1,163 @@
+import json
+import numpy as np
+from collections import namedtuple
+
+# exon, start codon or stop codon of a transcript: 1-based coordinates, both ends included (as in the GTF)
+Interval = namedtuple("Interval", ["start", "end"])
+
+CHILD_FEATURE_TYPES = ["exon", "start_codon", "stop_codon"]
+
+# maximum number of IDs in a single query (SQLite limits the number of parameters)
+QUERY_CHUNK_SIZE = 500
+
+
+# Annotation of a single transcript, with all the features needed to map variants: exons, start and stop codons, biotype.
+# Replaces gffutils Feature objects after the annotation has been read, so that no further DB queries are needed.
+# The exon coordinates are kept in arrays, together with the cumulative exon lengths (position of every exon start in the cDNA).
+# Uses __slots__ -> small in memory and cheap to send to worker processes.
+class TranscriptModel:
+    __slots__ = (
+        "id",
+        "chrom",
+        "start",
+        "end",
+        "strand",
+        "biotype",
+        "exon_starts",
+        "exon_ends",
+        "exon_offsets",
+        "start_codon",
+        "stop_codon",
+    )
+
+    # exons: list of Interval objects, sorted by start position
+    # start_codon, stop_codon: Interval, None if not annotated
+    def __init__(self, id, chrom, start, end, strand, biotype, exons, start_codon, stop_codon):
+        self.id = id
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.biotype = biotype
+
+        self.exon_starts = np.array([exon.start for exon in exons], dtype=np.int64)
+        self.exon_ends = np.array([exon.end for exon in exons], dtype=np.int64)
+        # exon_offsets[i] = sum of lengths of the exons before exon i, the last element is the length of the cDNA
+        self.exon_offsets = np.concatenate(
+            ([0], np.cumsum(self.exon_ends - self.exon_starts + 1))
+        ).astype(np.int64)
+
+        self.start_codon = start_codon
+        self.stop_codon = stop_codon
+
+    # pickled as raw bytes of the coordinate arrays, much smaller than the default pickle of numpy arrays
+    def __getstate__(self):
+        return (
+            self.id,
+            self.chrom,
+            self.start,
+            self.end,
+            self.strand,
+            self.biotype,
+            self.exon_starts.tobytes(),
+            self.exon_ends.tobytes(),
+            self.exon_offsets.tobytes(),
+            None if self.start_codon is None else tuple(self.start_codon),
+            None if self.stop_codon is None else tuple(self.stop_codon),
+        )
+
+    def __setstate__(self, state):
+        (
+            self.id,
+            self.chrom,
+            self.start,
+            self.end,
+            self.strand,
+            self.biotype,
+            exon_starts,
+            exon_ends,
+            exon_offsets,
+            start_codon,
+            stop_codon,
+        ) = state
+
+        self.exon_starts = np.frombuffer(exon_starts, dtype=np.int64)
+        self.exon_ends = np.frombuffer(exon_ends, dtype=np.int64)
+        self.exon_offsets = np.frombuffer(exon_offsets, dtype=np.int64)
+        self.start_codon = None if start_codon is None else Interval(*start_codon)
+        self.stop_codon = None if stop_codon is None else Interval(*stop_codon)
+
+    # list of exons as Interval objects, sorted by start position
+    @property
+    def exons(self):
+        return [
+            Interval(start, end)
+            for start, end in zip(self.exon_starts.tolist(), self.exon_ends.tolist())
+        ]
+
+    # total length of the exons
+    @property
+    def length(self):
+        return int(self.exon_offsets[-1])
+
+
+# Reads the transcripts with given IDs from the annotation DB together with their exons, start and stop codons, using a few bulk queries
+# instead of one query per transcript and feature type.
+# Returns a dict of TranscriptModel objects accessed by the transcript ID, transcripts not found in the DB are left out.
+# input:
+# annotations_db: FeatureDB of the GTF file
+# transcript_ids: list of transcript IDs
+def prefetch_transcripts(annotations_db, transcript_ids):
+    transcript_ids = list(dict.fromkeys(transcript_ids))
+    cursor = annotations_db.conn.cursor()
+    models = {}
+
+    for chunk_start in range(0, len(transcript_ids), QUERY_CHUNK_SIZE):
+        chunk = transcript_ids[chunk_start : chunk_start + QUERY_CHUNK_SIZE]
+        placeholders = ",".join(["?"] * len(chunk))
+
+        # the transcript features
+        cursor.execute(
+            "SELECT id, seqid, start, end, strand, attributes FROM features WHERE id IN ("
+            + placeholders
+            + ")",
+            chunk,
+        )
+        transcripts = cursor.fetchall()
+
+        # exons, start and stop codons of all the transcripts in the chunk
+        children = {
+            transcript_id: {featuretype: [] for featuretype in CHILD_FEATURE_TYPES}
+            for transcript_id in chunk
+        }
+        cursor.execute(
+            "SELECT DISTINCT relations.parent, features.id, features.featuretype, features.start, features.end "
+            "FROM features JOIN relations ON relations.child = features.id "
+            "WHERE relations.parent IN (" + placeholders + ") "
+            "AND features.featuretype IN ("
+            + ",".join(["?"] * len(CHILD_FEATURE_TYPES))
+            + ") ORDER BY relations.parent, features.start",
+            chunk + CHILD_FEATURE_TYPES,
+        )
+        for transcript_id, _, featuretype, start, end in cursor.fetchall():
+            children[transcript_id][featuretype].append(Interval(start, end))
+
+        for transcript_id, seqid, start, end, strand, attributes in transcripts:
+            biotype = json.loads(attributes).get("transcript_biotype", ["-"])[0]
+            start_codons = children[transcript_id]["start_codon"]
+            stop_codons = children[transcript_id]["stop_codon"]
+
+            models[transcript_id] = TranscriptModel(
+                transcript_id,
+                seqid,
+                start,
+                end,
+                strand,
+                biotype,
+                children[transcript_id]["exon"],
+                # there should be only one start codon, but just in case...
+                start_codons[0] if len(start_codons) > 0 else None,
+                stop_codons[0] if len(stop_codons) > 0 else None,
+            )
+
+    return models
@@ -0,0 +1,70 @@
+# Applies a list of changes to a cDNA sequence, building the mutated sequence in a single pass.
+# The changes are given in coordinates of the reference cDNA, in the order in which they should be applied.
+# input:
+# cdna: reference cDNA sequence (string)
+# rna_locations: location of every change in the reference cDNA
+# ref_alleles, alt_alleles: reference and alternative allele of every change (strings, '' for a deletion / insertion)
+# returns:
+# mutated_cdna: the mutated sequence (string), contains only the changes preceding the first mismatch if any
+# mutated_locations: location of every applied change in the mutated sequence (accounting for preceding indels)
+# mismatch_idx: index of the first change whose reference allele does not match the cDNA, -1 if all changes match
+def apply_changes(cdna, rna_locations, ref_alleles, alt_alleles):
+    # changes sorted by location and not overlapping -> the reference alleles can be checked directly in the reference,
+    # the mutated sequence is assembled from pieces of the reference and alternative alleles
+    is_sorted = (len(rna_locations) == 0 or rna_locations[0] >= 0) and all(
+        rna_locations[i] + len(ref_alleles[i]) <= rna_locations[i + 1]
+        for i in range(len(rna_locations) - 1)
+    )
+    if not is_sorted:
+        return apply_changes_sequential(cdna, rna_locations, ref_alleles, alt_alleles)
+
+    mutated_cdna = bytearray()
+    mutated_locations = []
+    sequence_length_diff = 0  # cummulative difference between the length of reference and mutated sequence
+    last_end = 0  # end of the last change in the reference
+
+    for ch_idx, rna_location in enumerate(rna_locations):
+        ref_allele = ref_alleles[ch_idx]
+        alt_allele = alt_alleles[ch_idx]
+        ref_len = len(ref_allele)
+
+        # check if what we expected to find is in fact in the cDNA
+        if cdna[rna_location : rna_location + ref_len] != ref_allele:
+            mutated_cdna += cdna[last_end:].encode()
+            return mutated_cdna.decode(), mutated_locations, ch_idx
+
+        mutated_cdna += cdna[last_end:rna_location].encode()
+        mutated_cdna += alt_allele.encode()
+        mutated_locations.append(rna_location + sequence_length_diff)
+
+        sequence_length_diff += len(alt_allele) - ref_len
+        last_end = rna_location + ref_len
+
+    mutated_cdna += cdna[last_end:].encode()
+    return mutated_cdna.decode(), mutated_locations, -1
+
+
+# Same as apply_changes, for changes that are not sorted by location or that overlap:
+# every change is placed in the partially mutated sequence, shifted by the length difference of all the preceding changes.
+def apply_changes_sequential(cdna, rna_locations, ref_alleles, alt_alleles):
+    mutated_cdna = bytearray(cdna.encode())
+    mutated_locations = []
+    sequence_length_diff = 0
+
+    for ch_idx, rna_location in enumerate(rna_locations):
+        ref_allele = ref_alleles[ch_idx].encode()
+        alt_allele = alt_alleles[ch_idx].encode()
+        ref_len = len(ref_allele)
+
+        # need to readjust the position in the mutated sequence in case there were indels before
+        rna_location += sequence_length_diff
+
+        # check if what we expected to find is in fact in the cDNA
+        if mutated_cdna[rna_location : rna_location + ref_len] != ref_allele:
+            return mutated_cdna.decode(), mutated_locations, ch_idx
+
+        mutated_cdna[rna_location : rna_location + ref_len] = alt_allele
+        mutated_locations.append(rna_location)
+        sequence_length_diff += len(alt_allele) - ref_len
+
+    return mutated_cdna.decode(), mutated_locations, -1
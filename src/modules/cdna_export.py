@@ -0,0 +1,43 @@
+import os
+import gzip
+import shutil
+
+
+# Exports the mutated cDNA sequences of haplotypes into a gzip-compressed FASTA file without keeping them in memory:
+# every worker process appends the sequences of a finished transcript to its own shard (a gzip member per transcript),
+# the shards are concatenated into the output file at the end (concatenated gzip members form a valid gzip file).
+class CdnaExport:
+    # output_file: path of the resulting FASTA file (.fa.gz), the shards are stored in a folder next to it
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.shard_folder = output_file + "_shards"
+
+    # create an empty folder for the shards, call before starting the workers
+    def prepare(self):
+        if os.path.exists(self.shard_folder):
+            shutil.rmtree(self.shard_folder)
+        os.makedirs(self.shard_folder)
+
+    # append sequences to the shard of the current process
+    # sequences: list of (ID, sequence) tuples
+    def write(self, sequences):
+        if len(sequences) == 0:
+            return
+
+        shard_file = os.path.join(self.shard_folder, str(os.getpid()) + ".fa.gz")
+        with gzip.open(shard_file, "at") as shard:
+            shard.write("".join([">" + seq_id + "\n" + seq + "\n" for seq_id, seq in sequences]))
+
+    # concatenate the shards into the output file and remove them, call after all the workers have finished
+    def finish(self):
+        shard_files = sorted(os.listdir(self.shard_folder))
+
+        if len(shard_files) == 0:
+            gzip.open(self.output_file, "wb").close()
+        else:
+            with open(self.output_file, "wb") as outfile:
+                for shard_file in shard_files:
+                    with open(os.path.join(self.shard_folder, shard_file), "rb") as shard:
+                        shutil.copyfileobj(shard, outfile)
+
+        shutil.rmtree(self.shard_folder)
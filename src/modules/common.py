@@ -1,3 +1,5 @@
+import hashlib
+import numpy as np
 import pandas as pd
 
 # returns an object containing all the sequences + metadata in the fasta file,  
@@ -5,73 +7,144 @@ import pandas as pd
 # all_elements[elementID] = {'tag': tag, 'accession': accession, 'description': description, 'sequence': sequence}
 def read_fasta(filename, truncate_accession = False):
 
-    fasta_file = open(filename, 'r')
-
-    metadata = fasta_file.readline()    # line starting with '>'
-    sequence = ""                       # all the other lines are considered sequences (considering also a multi-line format)
-
     all_elements = {}
 
-    # read the reference sequence database
-    while metadata != "":
-
-        line = fasta_file.readline() 
-        while not line.startswith('>') and not line == "":
-            sequence += line[:-1]
-            line = fasta_file.readline()
+    with open(filename, 'rb') as fasta_file:
+        for metadata, sequence in iter_fasta(fasta_file):
+            elementID, element = parse_fasta_header(metadata, truncate_accession)
+            element['sequence'] = sequence
+            all_elements[elementID] = element
 
-        tag = ''
-        accession = ''
-        description = ''
+    return all_elements
 
-        if "|" in metadata:					# the header is at least partially formated
-            metadata_parsed = metadata[1:].split('|')
-            if 'generic' in metadata_parsed[0]:
-                tag = metadata_parsed[0]
-            else:
-                tag = 'generic_' + metadata_parsed[0]
-
-            if len(metadata_parsed) == 2:					# accession and description are potentially merged -> separate them
-                if " " in metadata_parsed[1]:
-                    accession = metadata_parsed[1].split(' ')[0]
-                    description = metadata_parsed[1].split(' ', 1)[1]
-                else:
-                    accession = metadata_parsed[1]				# no description -> keep accession as it is
-            elif len(metadata_parsed) == 3:					# descripton and accesson already separated -> keep
-                accession = metadata_parsed[1]
-                description = metadata_parsed[2]
-
-        else:						                    # the header is not formated
-            accession = metadata[1:].split(" ")[0]
-            if " " in metadata:
-                description = metadata.split(" ", 1)[1]
-
-        if (truncate_accession):
-            elementID = accession.split('.')[0]
+# size of the blocks in which FASTA files are read
+FASTA_CHUNK_SIZE = 1 << 24
+
+# Iterates through the entries of a FASTA file (opened in binary mode), reading it in large blocks.
+# Every line starting with '>' starts a new entry, all the other lines are considered sequence (considering also a multi-line format).
+# yields: header line as in the file (including the leading '>' and the line break) and the sequence (None if headers_only is set),
+# the header is not parsed here -> callers parse only the entries they need
+def iter_fasta(fasta_file, headers_only = False):
+    pending = []        # blocks read but not processed yet, starting with a header line
+
+    while True:
+        chunk = fasta_file.read(FASTA_CHUNK_SIZE)
+        if chunk == b'':
+            break
+
+        # only complete entries are processed -> cut the block at the start of its last header line
+        cut = chunk.rfind(b'\n>') + 1
+        if (cut == 0) and not (chunk.startswith(b'>') and (len(pending) > 0) and pending[-1].endswith(b'\n')):
+            pending.append(chunk)
+            continue
+
+        yield from parse_fasta_block(b''.join(pending) + chunk[:cut], headers_only)
+        pending = [chunk[cut:]]
+
+    if len(pending) > 0:
+        yield from parse_fasta_block(b''.join(pending), headers_only)
+
+# split a block of complete FASTA entries, see iter_fasta
+def parse_fasta_block(block, headers_only):
+    if len(block) == 0:
+        return
+
+    if b'\r' in block:
+        block = block.replace(b'\r\n', b'\n')
+
+    entries = block.split(b'\n>')
+    for i, entry in enumerate(entries):
+        if i > 0:
+            entry = b'>' + entry
+        if i < len(entries) - 1:
+            entry += b'\n'
+
+        header_end = entry.find(b'\n') + 1
+        if header_end == 0:
+            header_end = len(entry)
+
+        if headers_only:
+            yield entry[:header_end].decode(), None
+            continue
+
+        # the last character of every line is removed, i.e., the line breaks
+        sequence = entry[header_end:]
+        if (len(sequence) > 0) and not sequence.endswith(b'\n'):
+            sequence = sequence[:-1]
+
+        yield entry[:header_end].decode(), sequence.replace(b'\n', b'').decode()
+
+# parse the header line of a FASTA entry (including the leading '>')
+# returns: ID of the element (accession, truncated at the first '.' if requested) and a dict with the tag, accession and description
+def parse_fasta_header(metadata, truncate_accession = False):
+    tag = ''
+    accession = ''
+    description = ''
+
+    if "|" in metadata:					# the header is at least partially formated
+        metadata_parsed = metadata[1:].split('|')
+        if 'generic' in metadata_parsed[0]:
+            tag = metadata_parsed[0]
         else:
-            elementID = accession
+            tag = 'generic_' + metadata_parsed[0]
 
-        all_elements[elementID] = {'tag': tag, 'accession': accession, 'description': description.replace('\n', ''), 'sequence': sequence}
+        if len(metadata_parsed) == 2:					# accession and description are potentially merged -> separate them
+            if " " in metadata_parsed[1]:
+                accession = metadata_parsed[1].split(' ')[0]
+                description = metadata_parsed[1].split(' ', 1)[1]
+            else:
+                accession = metadata_parsed[1]				# no description -> keep accession as it is
+        elif len(metadata_parsed) == 3:					# descripton and accesson already separated -> keep
+            accession = metadata_parsed[1]
+            description = metadata_parsed[2]
+
+    else:						                    # the header is not formated
+        accession = metadata[1:].split(" ")[0]
+        if " " in metadata:
+            description = metadata.split(" ", 1)[1]
+
+    if (truncate_accession):
+        elementID = accession.split('.')[0]
+    else:
+        elementID = accession
+
+    return elementID, {'tag': tag, 'accession': accession, 'description': description.replace('\n', '')}
+
+# keep only the value of the given allele in INFO fields holding allele frequencies per ALT allele (e.g., AF=0.1,0.02 -> AF=0.02)
+def select_allele_info(info, allele_idx, allele_count):
+    fields = info.split(';')
+    for i, field in enumerate(fields):
+        if '=' not in field:
+            continue
+        key, values = field.split('=', 1)
+        values = values.split(',')
+        if ('AF' in key) and (len(values) == allele_count):
+            fields[i] = key + '=' + values[allele_idx]
+    return ';'.join(fields)
+
+# split multi-allelic rows into one row per ALT allele, the other columns are repeated (keeping their dtypes)
+# returns a dataframe with a new index (0 .. number of rows - 1)
+def check_vcf_df(in_df):
+    ALT_alleles = in_df['ALT'].astype(str).str.split(',')
+    allele_counts = ALT_alleles.str.len().to_numpy()
 
-        metadata = line
-        sequence = ""
+    # no multi-allelic rows
+    if (allele_counts == 1).all():
+        return in_df.reset_index(drop=True)
 
-    fasta_file.close()
+    result_df = in_df.iloc[np.repeat(np.arange(len(in_df)), allele_counts)].reset_index(drop=True)
+    result_df['ALT'] = np.concatenate(ALT_alleles.to_numpy())
 
-    return all_elements
+    # per-allele values in the INFO column
+    if 'INFO' in result_df.columns:
+        allele_idx = np.arange(len(result_df)) - np.repeat(np.cumsum(allele_counts) - allele_counts, allele_counts)
+        row_allele_counts = np.repeat(allele_counts, allele_counts)
+        result_df['INFO'] = [
+            (select_allele_info(info, idx, count) if count > 1 else info)
+            for info, idx, count in zip(result_df['INFO'].tolist(), allele_idx.tolist(), row_allele_counts.tolist())
+        ]
 
-def check_vcf_df(in_df):
-        result_columns = in_df.columns.values
-        result_data = []
-        for index,row in in_df.iterrows():
-                ALT_alleles = row['ALT'].split(',')
-                REF = row['REF']
-                for ALT in ALT_alleles:
-                        result_row = row.tolist()
-                        result_row[4] = ALT
-                        result_data.append(result_row)
-        result_df = pd.DataFrame(columns=result_columns, data=result_data)
-        return result_df
+    return result_df
 
 # hepler class for bisect to sort objects
 class KeyWrapper:
@@ -87,3 +160,72 @@ class KeyWrapper:
 
     def insert(self, index, item):
         self.it.insert(index, item)
+
+# stable 128-bit digest of a sequence, the same in every process (unlike hash())
+def sequence_digest(sequence):
+    return hashlib.blake2b(str(sequence).encode(), digest_size=16).digest()
+
+# Collection of unique sequences, accessed by their digest.
+# Every entry is a dict holding the sequence ('sequence'), its digest ('hash'), fields given when the sequence was first added,
+# and lists of values aggregated over all the occurrences of the sequence (e.g., IDs of matching haplotypes and their reading frames).
+class SequenceRegistry:
+    def __init__(self):
+        self.entries = {}
+        self.list_fields = set()    # names of the fields aggregated in lists
+
+    def __len__(self):
+        return len(self.entries)
+
+    # entries in the order in which the sequences were first added
+    def values(self):
+        return list(self.entries.values())
+
+    # Adds a sequence. If it is already present, the values are appended to the lists of the existing entry,
+    # otherwise a new entry is created with the fields and a list for each of the values. Returns the entry.
+    def add(self, sequence, values, fields=None):
+        digest = sequence_digest(sequence)
+        entry = self.entries.get(digest)
+
+        if entry is None:
+            entry = {'hash': digest, 'sequence': sequence}
+            if fields is not None:
+                entry.update(fields)
+            for key, value in values.items():
+                entry[key] = [value]
+            self.entries[digest] = entry
+            self.list_fields.update(values.keys())
+        else:
+            for key, value in values.items():
+                entry[key].append(value)
+
+        return entry
+
+    # Merges the entries of another registry (e.g., created by another worker process) into this one
+    def update(self, other):
+        for digest, other_entry in other.entries.items():
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.entries[digest] = other_entry
+            else:
+                for key in other.list_fields:
+                    entry.setdefault(key, []).extend(other_entry.get(key, []))
+        self.list_fields.update(other.list_fields)
+
+# helper for map_by_cost: call the function on a task, return the result together with the index of the task
+def call_indexed(indexed_task):
+    function, task_idx, task = indexed_task
+    return task_idx, function(task)
+
+# Runs the function on all the tasks in the pool, the tasks with the highest estimated cost are dispatched first,
+# in small chunks, so that a few large tasks (e.g., very long transcripts) do not leave the other processes idle at the end of the run.
+# The function must be accessible on the module level (same requirement as for Pool.map).
+# costs: estimated cost of every task
+# returns: list of results in the order of the tasks
+def map_by_cost(pool, function, tasks, costs, chunksize=1):
+    order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+    results = [None] * len(tasks)
+
+    for task_idx, result in pool.imap_unordered(call_indexed, [(function, i, tasks[i]) for i in order], chunksize):
+        results[task_idx] = result
+
+    return results
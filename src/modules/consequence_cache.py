@@ -0,0 +1,148 @@
+import os
+import sqlite3
+from Bio.Seq import Seq
+
+
+# Computes the effect of a single variant on the cDNA of a transcript, regardless of other changes in the haplotype.
+# The alleles are truncated at splice sites, and reverse complemented on the reverse strand, as is the location (counted from the end).
+# variant: any object with the POS, REF and ALT attributes (e.g., Variant or a row of the VCF)
+# returns: location in the cDNA, ref allele, ref length, alt allele, alt length, affected splice junction (None if none),
+# frameshift (boolean), variant type on the cDNA level (SNP, indel or splice)
+def get_variant_effect(variant, mapper, cdna_length, reverse_strand):
+    ref_allele = variant.REF
+    alt_allele = variant.ALT
+
+    # in case the allele is fully deleted
+    if ref_allele == "-":
+        ref_allele = Seq("")
+    else:
+        ref_allele = Seq(ref_allele)
+
+    if alt_allele == "-":
+        alt_allele = Seq("")
+    else:
+        alt_allele = Seq(alt_allele)
+
+    dna_location = int(variant.POS)
+
+    # compute the location in the RNA sequence
+    # does any of the allele sequences intersect a splicing site? => truncate if so
+    (
+        rna_location,
+        ref_allele,
+        ref_len,
+        alt_allele,
+        alt_len,
+        mutation_intersects_intron,
+    ) = mapper.rna_position_allele(dna_location, ref_allele, alt_allele)
+
+    # boolean - does this introduce a frameshift?
+    frameshift = (abs(ref_len - alt_len) % 3) != 0
+
+    # get the general variant type
+    if mutation_intersects_intron is not None:
+        dna_var_type = "splice"
+    elif ref_len == alt_len:
+        dna_var_type = "SNP"
+    else:
+        dna_var_type = "indel"
+
+    # if we are on a reverse strand, we need to complement the reference and alternative sequence to match the cDNA
+    # we also need to count the position from the end
+    if reverse_strand:
+        ref_allele = ref_allele.reverse_complement()
+        alt_allele = alt_allele.reverse_complement()
+        rna_location = cdna_length - rna_location - ref_len
+
+    return (
+        rna_location,
+        str(ref_allele),
+        ref_len,
+        str(alt_allele),
+        alt_len,
+        mutation_intersects_intron,
+        frameshift,
+        dna_var_type,
+    )
+
+
+# Persistent cache of variant effects (as returned by get_variant_effect), shared by ProVar and ProHap.
+# The effect of a variant depends only on the transcript annotation and the variant itself, not on the thresholds or other variants,
+# so it can be reused by the other tool and by later runs on the same chromosome.
+# The cache is an SQLite database, every process opens its own connection (concurrent writers wait for each other).
+# Entries are accessed by the transcript ID, the length of the cDNA (as a check that the reference has not changed), position and alleles.
+class ConsequenceCache:
+    columns = [
+        "rna_location",
+        "ref_allele",
+        "ref_len",
+        "alt_allele",
+        "alt_len",
+        "splice_junction",
+        "frameshift",
+        "dna_var_type",
+    ]
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.connection = None
+        self.connection_pid = None
+
+    def __len__(self):
+        return self.connect().execute("SELECT COUNT(*) FROM effects").fetchone()[0]
+
+    # connection of the current process, opened when first needed
+    def connect(self):
+        if (self.connection is None) or (self.connection_pid != os.getpid()):
+            self.connection = sqlite3.connect(self.cache_file, timeout=600)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS effects ("
+                "transcript_id TEXT, cdna_length INTEGER, POS INTEGER, REF TEXT, ALT TEXT, "
+                "rna_location INTEGER, ref_allele TEXT, ref_len INTEGER, alt_allele TEXT, alt_len INTEGER, "
+                "splice_junction INTEGER, frameshift INTEGER, dna_var_type TEXT, "
+                "PRIMARY KEY (transcript_id, cdna_length, POS, REF, ALT))"
+            )
+            self.connection.commit()
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    # all the cached effects of variants in a transcript
+    # returns: dict (POS, REF, ALT) -> effect
+    def transcript_effects(self, transcript_id, cdna_length):
+        rows = self.connect().execute(
+            "SELECT POS, REF, ALT, " + ", ".join(self.columns) + " FROM effects WHERE transcript_id = ? AND cdna_length = ?",
+            (transcript_id, cdna_length),
+        )
+
+        effects = {}
+        for row in rows:
+            rna_location, ref_allele, ref_len, alt_allele, alt_len, splice_junction, frameshift, dna_var_type = row[3:]
+            effects[(row[0], row[1], row[2])] = (
+                rna_location,
+                ref_allele,
+                ref_len,
+                alt_allele,
+                alt_len,
+                splice_junction,
+                bool(frameshift),
+                dna_var_type,
+            )
+        return effects
+
+    # store newly computed effects of variants in a transcript
+    # effects: dict (POS, REF, ALT) -> effect, as returned by get_variant_effect
+    def store(self, transcript_id, cdna_length, effects):
+        if len(effects) == 0:
+            return
+
+        connection = self.connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO effects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (transcript_id, cdna_length, int(POS), REF, ALT, int(effect[0]), effect[1], effect[2], effect[3], effect[4],
+                     (int(effect[5]) if effect[5] is not None else None), int(effect[6]), effect[7])
+                    for (POS, REF, ALT), effect in effects.items()
+                ],
+            )
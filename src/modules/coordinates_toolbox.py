@@ -1,172 +1,207 @@
-from Bio.Seq import Seq
-from numpy import ceil, floor
-
-'''
-Computes the position of the mutation in the RNA sequence. 
-Checks whether the reference allele intersects a splice junction - truncates the sequences (both reference and alternative, if applicable) if so.
-Special case: Mutation reaches over an intron into another exon. Probably covered but not tested.
-'''
-def get_rna_position(transcript_id, dna_location, ref_allele, alt_allele, exons):
-    ref_len = len(ref_allele)
-    alt_len = len(alt_allele)
-    rna_location = 0
-    found = False
-    mutation_intersects_intron = None
-
-    # find the corresponding exon - see how many nucleotides were there before
-    for exon_idx,exon in enumerate(exons):
-        # exon before the mutation -> remember the full length
-        if (exon.end < dna_location):
-            rna_location += (exon.end - exon.start + 1)
-        
-        # exon where the mutation happens -> remember position within
-        # check for allele sequences ovrlapping borders of the exon
-        elif (exon.start < (dna_location + ref_len)):
-            
-            # check if the mutation covers the intron before
-            if (exon.start > dna_location):
-                intronic_len = exon.start - dna_location
-                ref_allele = ref_allele[intronic_len:]
-                alt_allele = alt_allele[intronic_len:]
-
-                ref_len = ref_len - intronic_len
-                alt_len = len(alt_allele)
-
-                dna_location += intronic_len
-
-                mutation_intersects_intron = exon_idx
-
-            rna_location += (dna_location - exon.start)
-            found = True
-
-            if (dna_location + ref_len > exon.end):
-                remaining_length = exon.end - dna_location + 1
-                mutation_intersects_intron = exon_idx + 1
-
-                # check if the mutation does not reach into the next exon
-                if exon_idx < (len(exons) - 1) and (dna_location + ref_len > exons[exon_idx+1].start):
-                    next_exon = exons[exon_idx+1]
-                    start_again = next_exon.start - dna_location
-
-                    ref_allele = ref_allele[:remaining_length] + ref_allele[start_again:]
-                    ref_len = len(ref_allele)
-                else:
-                    ref_allele = ref_allele[:remaining_length]
-                    ref_len = remaining_length
-
-                # if there is an insertion that prolongs an exon, keep it, 
-                # only truncate the alternative allele if the reference overlaps
-                if (dna_location + alt_len > exon.end):
-                    remaining_length = exon.end - dna_location + 1
-
-                    # check if the mutation does not reach into the next exon
-                    if exon_idx < (len(exons) - 1) and (dna_location + alt_len > exons[exon_idx+1].start):
-                        next_exon = exons[exon_idx+1]
-                        start_again = next_exon.start - dna_location
-
-                        alt_allele = alt_allele[:remaining_length] + alt_allele[start_again:]
-                        alt_len = len(alt_allele)
-                    else:
-                        alt_allele = alt_allele[:remaining_length]
-                        alt_len = remaining_length
-
-            # remember if we change the last or first 3 letters in the exon
-            elif (exon.end - dna_location + ref_len < 3):
-                mutation_intersects_intron = exon_idx + 1
-            
-            elif (dna_location - exon.start < 3):
-                mutation_intersects_intron = exon_idx
-
-            break
-
-    if not found:
-        print(transcript_id + ': DNA location ' + str(dna_location) + ' is not in an exon.')
-    
-    return rna_location, ref_allele, ref_len, alt_allele, alt_len, mutation_intersects_intron
-
-
-def get_rna_position_simple(transcript_id,dna_location, exons):
-    rna_location = 0
-    found = False
-
-    # find the corresponding exon - see how many nucleotides were there before
-    for exon in exons:
-        # exon before the location -> remember the full length
-        if (exon.end < dna_location):
-            rna_location += (exon.end - exon.start + 1)
-        elif (exon.start <= dna_location):
-            found = True
-            rna_location += (dna_location - exon.start)
-            break
-
-    if not found:
-        raise Exception(transcript_id + ': DNA location ' + str(dna_location) + ' is not in an exon.')
-
-    return rna_location
-
-def rna_to_dna_loc(rna_location, exons):
-    rna_loc_accum = 0
-
-    # find the corresponding exon - see how many nucleotides were there before
-    for exon in exons:
-        exon_len = exon.end - exon.start + 1
-
-        if (rna_location < (rna_loc_accum + exon_len)):
-            return exon.start + rna_location - rna_loc_accum
-
-        rna_loc_accum += exon_len
-
-    return -1
-
-# check if we have an alteration of the start codon (either inframe indel before it, or stop loss)
-# return new start location, -1 if start lost
-def check_start_change(original_start, original_rf, variant_rna_loc, ref_len, alt_len, ignore_frameshift):
-    if (variant_rna_loc < original_start+3):
-        if (variant_rna_loc + ref_len > original_start):
-            return -1, -1   # original start codon affected by change
-
-        if (abs(alt_len - ref_len) % 3) != 0: # frameshift before start codon
-            if (ignore_frameshift):
-                return original_start + (alt_len - ref_len), (original_rf  + (alt_len - ref_len)) % 3
-            return -1, -1    
-
-        # stop codon might be shifted by inframe indel
-        return original_start + (alt_len - ref_len), original_rf
-
-    # change happening after start codon
-    return original_start, original_rf
-
-def get_affected_codons(cdna, allele_loc, allele_len, reading_frame, protein_start):
-    alleles_protein = []        # residues directly affected (ignoring prossible frameshift), stored in a list for all three reading frames
-    protein_location = []       # location of these residues in the protein (can be negative if in 5' UTR), creating a list as it can differ with reading frame
-    
-    if (reading_frame == -1):
-        for rf in range(3):                    
-            protein_location.append(int(floor((allele_loc - rf) / 3)))
-    else:
-        protein_location = [int(floor((allele_loc - reading_frame) / 3) -  protein_start)]
-
-    bpFrom = int(floor((allele_loc - max(reading_frame, 0)) / 3) * 3 + max(reading_frame, 0))   # if reading frame is unknown, assume 0 and add other reading frames later
-    bpFrom = max(max(bpFrom, 0), reading_frame)                                                 # in case the beginning of the change is before the reading frame start
-
-    bpTo = int(ceil((allele_loc + allele_len - max(reading_frame, 0)) / 3) * 3 + max(reading_frame, 0))
-
-    if (bpTo-bpFrom > 2): # make sure we have at least 1 codon covered
-        affected_codons = Seq(str(cdna[bpFrom:bpTo]))
-        alleles_protein = [str(affected_codons.transcribe().translate())]
-    else:
-        alleles_protein = ['-']
-
-    if reading_frame == -1:
-        for rf in [1,2]:
-            bpFrom = int(floor((allele_loc - rf) / 3) * 3 + rf) 
-            bpFrom = max(max(bpFrom, 0), rf)                                                    
-            bpTo = int(ceil((allele_loc + allele_len - rf) / 3) * 3 + rf)
-
-            if (bpTo-bpFrom > 2): # make sure we have at least 1 codon covered
-                affected_codons = Seq(str(cdna[bpFrom:bpTo]))
-                alleles_protein.append(str(affected_codons.transcribe().translate()))
-            else:
-                alleles_protein.append('-')
-
-    return alleles_protein, protein_location
+import bisect
+import numpy as np
+from modules.translation import translate
+from numpy import ceil, floor
+
+# Maps coordinates between the chromosome (DNA) and the cDNA of a single transcript.
+# The exon boundaries and cumulative exon lengths are computed once, every query is a binary search over the exons -> O(log exons).
+# Coordinates on the DNA are 1-based (as in the GTF and VCF), coordinates in the cDNA are 0-based, counted from the leftmost exon.
+class CoordinateMapper:
+    # exon_starts, exon_ends: coordinates of the exons, sorted by start position
+    # exon_offsets: total length of exons before each exon, the last element is the total length (computed if not given)
+    def __init__(self, transcript_id, exon_starts, exon_ends, exon_offsets=None):
+        self.transcript_id = transcript_id
+        self.starts_array = np.asarray(exon_starts, dtype=np.int64)
+        self.ends_array = np.asarray(exon_ends, dtype=np.int64)
+        if exon_offsets is None:
+            exon_offsets = np.concatenate(([0], np.cumsum(self.ends_array - self.starts_array + 1)))
+        self.offsets_array = np.asarray(exon_offsets, dtype=np.int64)
+
+        # the same as lists, for queries of single positions (faster than indexing numpy arrays)
+        self.starts = self.starts_array.tolist()
+        self.ends = self.ends_array.tolist()
+        self.offsets = self.offsets_array.tolist()
+
+    @classmethod
+    def from_transcript(cls, transcript):
+        return cls(transcript.id, transcript.exon_starts, transcript.exon_ends, transcript.exon_offsets)
+
+    # index of the first exon that ends at or after the DNA location (len(exons) if none)
+    def exon_index(self, dna_location):
+        return bisect.bisect_left(self.ends, dna_location)
+
+    # Computes the position of the mutation in the RNA sequence.
+    # Checks whether the reference allele intersects a splice junction - truncates the sequences (both reference and alternative, if applicable) if so.
+    # Special case: Mutation reaches over an intron into another exon. Probably covered but not tested.
+    def rna_position_allele(self, dna_location, ref_allele, alt_allele):
+        ref_len = len(ref_allele)
+        alt_len = len(alt_allele)
+        mutation_intersects_intron = None
+
+        # find the corresponding exon - see how many nucleotides were there before
+        exon_idx = self.exon_index(dna_location)
+        rna_location = self.offsets[exon_idx]
+
+        # the exon must overlap the allele, otherwise the mutation is not in an exon
+        if exon_idx == len(self.starts) or self.starts[exon_idx] >= (dna_location + ref_len):
+            print(self.transcript_id + ': DNA location ' + str(dna_location) + ' is not in an exon.')
+            return rna_location, ref_allele, ref_len, alt_allele, alt_len, mutation_intersects_intron
+
+        exon_start = self.starts[exon_idx]
+        exon_end = self.ends[exon_idx]
+        has_next_exon = exon_idx < (len(self.starts) - 1)
+
+        # check if the mutation covers the intron before
+        if (exon_start > dna_location):
+            intronic_len = exon_start - dna_location
+            ref_allele = ref_allele[intronic_len:]
+            alt_allele = alt_allele[intronic_len:]
+
+            ref_len = ref_len - intronic_len
+            alt_len = len(alt_allele)
+
+            dna_location += intronic_len
+
+            mutation_intersects_intron = exon_idx
+
+        rna_location += (dna_location - exon_start)
+
+        if (dna_location + ref_len > exon_end):
+            remaining_length = exon_end - dna_location + 1
+            mutation_intersects_intron = exon_idx + 1
+
+            # check if the mutation does not reach into the next exon
+            if has_next_exon and (dna_location + ref_len > self.starts[exon_idx+1]):
+                start_again = self.starts[exon_idx+1] - dna_location
+
+                ref_allele = ref_allele[:remaining_length] + ref_allele[start_again:]
+                ref_len = len(ref_allele)
+            else:
+                ref_allele = ref_allele[:remaining_length]
+                ref_len = remaining_length
+
+            # if there is an insertion that prolongs an exon, keep it,
+            # only truncate the alternative allele if the reference overlaps
+            if (dna_location + alt_len > exon_end):
+                remaining_length = exon_end - dna_location + 1
+
+                # check if the mutation does not reach into the next exon
+                if has_next_exon and (dna_location + alt_len > self.starts[exon_idx+1]):
+                    start_again = self.starts[exon_idx+1] - dna_location
+
+                    alt_allele = alt_allele[:remaining_length] + alt_allele[start_again:]
+                    alt_len = len(alt_allele)
+                else:
+                    alt_allele = alt_allele[:remaining_length]
+                    alt_len = remaining_length
+
+        # remember if we change the last or first 3 letters in the exon
+        elif (exon_end - dna_location + ref_len < 3):
+            mutation_intersects_intron = exon_idx + 1
+
+        elif (dna_location - exon_start < 3):
+            mutation_intersects_intron = exon_idx
+
+        return rna_location, ref_allele, ref_len, alt_allele, alt_len, mutation_intersects_intron
+
+    # position of a single nucleotide in the RNA, raises an exception if not in an exon
+    def rna_position(self, dna_location):
+        exon_idx = self.exon_index(dna_location)
+
+        if exon_idx == len(self.starts) or self.starts[exon_idx] > dna_location:
+            raise Exception(self.transcript_id + ': DNA location ' + str(dna_location) + ' is not in an exon.')
+
+        return self.offsets[exon_idx] + (dna_location - self.starts[exon_idx])
+
+    # position of a single nucleotide in the DNA, -1 if beyond the end of the transcript
+    def dna_position(self, rna_location):
+        exon_idx = bisect.bisect_right(self.offsets, rna_location, lo=1) - 1
+
+        if exon_idx >= len(self.starts):
+            return -1
+
+        return self.starts[exon_idx] + rna_location - self.offsets[exon_idx]
+
+    # batched version of rna_position: maps an array of DNA locations at once, -1 for locations outside of exons
+    def rna_positions(self, dna_locations):
+        dna_locations = np.asarray(dna_locations, dtype=np.int64)
+        if len(self.starts) == 0:
+            return np.full(len(dna_locations), -1, dtype=np.int64)
+
+        exon_idx = np.searchsorted(self.ends_array, dna_locations, side="left")
+        in_range = exon_idx < len(self.starts)
+        clipped_idx = np.minimum(exon_idx, len(self.starts) - 1)
+
+        in_exon = in_range & (self.starts_array[clipped_idx] <= dna_locations)
+        return np.where(
+            in_exon,
+            self.offsets_array[clipped_idx] + dna_locations - self.starts_array[clipped_idx],
+            -1,
+        )
+
+    # batched version of dna_position: maps an array of RNA locations at once, -1 for locations beyond the end of the transcript
+    def dna_positions(self, rna_locations):
+        rna_locations = np.asarray(rna_locations, dtype=np.int64)
+        if len(self.starts) == 0:
+            return np.full(len(rna_locations), -1, dtype=np.int64)
+
+        exon_idx = np.searchsorted(self.offsets_array[1:], rna_locations, side="right")
+        in_range = exon_idx < len(self.starts)
+        clipped_idx = np.minimum(exon_idx, len(self.starts) - 1)
+        return np.where(
+            in_range,
+            self.starts_array[clipped_idx] + rna_locations - self.offsets_array[clipped_idx],
+            -1,
+        )
+
+
+# check if we have an alteration of the start codon (either inframe indel before it, or stop loss)
+# return new start location, -1 if start lost
+def check_start_change(original_start, original_rf, variant_rna_loc, ref_len, alt_len, ignore_frameshift):
+    if (variant_rna_loc < original_start+3):
+        if (variant_rna_loc + ref_len > original_start):
+            return -1, -1   # original start codon affected by change
+
+        if (abs(alt_len - ref_len) % 3) != 0: # frameshift before start codon
+            if (ignore_frameshift):
+                return original_start + (alt_len - ref_len), (original_rf  + (alt_len - ref_len)) % 3
+            return -1, -1    
+
+        # stop codon might be shifted by inframe indel
+        return original_start + (alt_len - ref_len), original_rf
+
+    # change happening after start codon
+    return original_start, original_rf
+
+def get_affected_codons(cdna, allele_loc, allele_len, reading_frame, protein_start):
+    alleles_protein = []        # residues directly affected (ignoring prossible frameshift), stored in a list for all three reading frames
+    protein_location = []       # location of these residues in the protein (can be negative if in 5' UTR), creating a list as it can differ with reading frame
+    
+    if (reading_frame == -1):
+        for rf in range(3):                    
+            protein_location.append(int(floor((allele_loc - rf) / 3)))
+    else:
+        protein_location = [int(floor((allele_loc - reading_frame) / 3) -  protein_start)]
+
+    bpFrom = int(floor((allele_loc - max(reading_frame, 0)) / 3) * 3 + max(reading_frame, 0))   # if reading frame is unknown, assume 0 and add other reading frames later
+    bpFrom = max(max(bpFrom, 0), reading_frame)                                                 # in case the beginning of the change is before the reading frame start
+
+    bpTo = int(ceil((allele_loc + allele_len - max(reading_frame, 0)) / 3) * 3 + max(reading_frame, 0))
+
+    if (bpTo-bpFrom > 2): # make sure we have at least 1 codon covered
+        alleles_protein = [translate(cdna[bpFrom:bpTo])]
+    else:
+        alleles_protein = ['-']
+
+    if reading_frame == -1:
+        for rf in [1,2]:
+            bpFrom = int(floor((allele_loc - rf) / 3) * 3 + rf) 
+            bpFrom = max(max(bpFrom, 0), rf)                                                    
+            bpTo = int(ceil((allele_loc + allele_len - rf) / 3) * 3 + rf)
+
+            if (bpTo-bpFrom > 2): # make sure we have at least 1 codon covered
+                alleles_protein.append(translate(cdna[bpFrom:bpTo]))
+            else:
+                alleles_protein.append('-')
+
+    return alleles_protein, protein_location
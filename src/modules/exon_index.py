@@ -0,0 +1,51 @@
+import bisect
+
+
+# Chromosome-wide index of exon intervals, built once from the transcript annotations.
+# The exon coordinates are split into elementary segments by all the exon boundaries, every segment stores the transcripts
+# whose exons cover it -> all transcripts overlapping a variant are found by a single binary search.
+class ExonIndex:
+    # transcript_exons: list of (transcript ID, list of exon features) pairs
+    def __init__(self, transcript_exons):
+        events = []  # (position, +1 / -1, transcript ID) - exons are closed intervals, coverage ends at (end + 1)
+        for transcript_id, exons in transcript_exons:
+            for exon in exons:
+                events.append((exon.start, 1, transcript_id))
+                events.append((exon.end + 1, -1, transcript_id))
+        events.sort(key=lambda x: x[0])
+
+        self.boundaries = []  # start positions of the elementary segments
+        self.segments = []  # transcript IDs covering each segment
+
+        active = {}  # transcript ID -> number of its exons covering the current position
+        i = 0
+        while i < len(events):
+            position = events[i][0]
+
+            # apply all the events at this position
+            while i < len(events) and events[i][0] == position:
+                transcript_id = events[i][2]
+                active[transcript_id] = active.get(transcript_id, 0) + events[i][1]
+                if active[transcript_id] == 0:
+                    del active[transcript_id]
+                i += 1
+
+            self.boundaries.append(position)
+            self.segments.append(tuple(active))
+
+    # returns the IDs of transcripts that have an exon overlapping the interval [start, end] (both inclusive)
+    def overlapping(self, start, end):
+        last = bisect.bisect_right(self.boundaries, end) - 1
+        if last < 0:
+            return ()
+
+        first = max(bisect.bisect_right(self.boundaries, start) - 1, 0)
+        if first == last:
+            return self.segments[first]
+
+        # more segments covered (e.g., long deletions) -> merge, keep the order
+        result = {}
+        for segment in self.segments[first : last + 1]:
+            result.update(dict.fromkeys(segment))
+
+        return tuple(result)
@@ -0,0 +1,116 @@
+import os
+import mmap
+import numpy as np
+from modules.common import parse_fasta_header
+
+
+# path of the offset index belonging to a FASTA file
+def fasta_index_file(filename):
+    return filename + ".offsets.npy"
+
+
+# Scans a FASTA file and stores the offsets of its entries next to it (see fasta_index_file),
+# as a matrix of shape (entries, 3): start of the header line, start of the sequence, end of the sequence.
+# Every line starting with '>' starts a new entry (same as read_fasta).
+# returns: the offset matrix
+def build_fasta_index(filename):
+    with open(filename, "rb") as fasta_file:
+        size = os.fstat(fasta_file.fileno()).st_size
+        if size == 0:
+            offsets = np.zeros((0, 3), dtype=np.int64)
+        else:
+            with mmap.mmap(fasta_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header_offsets = [0]
+                pos = data.find(b"\n>")
+                while pos != -1:
+                    header_offsets.append(pos + 1)
+                    pos = data.find(b"\n>", pos + 1)
+
+                sequence_offsets = []
+                for header_offset in header_offsets:
+                    header_end = data.find(b"\n", header_offset)
+                    sequence_offsets.append(header_end + 1 if header_end != -1 else size)
+
+            offsets = np.array(
+                [header_offsets, sequence_offsets, header_offsets[1:] + [size]],
+                dtype=np.int64,
+            ).T
+
+    # write to a temporary file first, so that other jobs never see an incomplete index
+    tmp_file = fasta_index_file(filename) + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_file, "wb") as index_file:
+        np.save(index_file, offsets)
+    os.replace(tmp_file, fasta_index_file(filename))
+
+    return offsets
+
+
+# Loads the offset index of a FASTA file, (re)builds it if missing or older than the FASTA file
+def load_fasta_index(filename):
+    index_file = fasta_index_file(filename)
+    if (not os.path.exists(index_file)) or (
+        os.path.getmtime(index_file) < os.path.getmtime(filename)
+    ):
+        return build_fasta_index(filename)
+    return np.load(index_file)
+
+
+# Random access to the entries of a FASTA file, as an alternative to read_fasta for large files of which only a few entries are needed:
+# the file is memory-mapped, only the element IDs and offsets are kept in memory, the sequence is read when an entry is accessed.
+# Entries are returned in the same format as by read_fasta: {'tag': tag, 'accession': accession, 'description': description, 'sequence': sequence}
+class IndexedFasta:
+    def __init__(self, filename, truncate_accession=False):
+        self.filename = filename
+        self.fasta_file = open(filename, "rb")
+        offsets = load_fasta_index(filename)
+
+        if len(offsets) > 0:
+            self.data = mmap.mmap(self.fasta_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""
+
+        # element ID -> (start of the header, start of the sequence, end of the sequence), the last entry wins in case of duplicates
+        self.offsets = {}
+        for header_offset, sequence_offset, sequence_end in offsets.tolist():
+            elementID, _ = parse_fasta_header(
+                self.read_text(header_offset, sequence_offset), truncate_accession
+            )
+            self.offsets[elementID] = (header_offset, sequence_offset, sequence_end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, elementID):
+        return elementID in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def keys(self):
+        return self.offsets.keys()
+
+    # part of the file as a string, with the line endings normalized as in text mode
+    def read_text(self, start, end):
+        return self.data[start:end].decode().replace("\r\n", "\n")
+
+    def __getitem__(self, elementID):
+        header_offset, sequence_offset, sequence_end = self.offsets[elementID]
+        _, element = parse_fasta_header(self.read_text(header_offset, sequence_offset))
+
+        # the last character of every line is removed (as in read_fasta), i.e., the line breaks
+        sequence = self.read_text(sequence_offset, sequence_end)
+        if (sequence != "") and not sequence.endswith("\n"):
+            sequence = sequence[:-1]
+        element["sequence"] = sequence.replace("\n", "")
+
+        return element
+
+    def get(self, elementID, default=None):
+        if elementID in self.offsets:
+            return self[elementID]
+        return default
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fasta_file.close()
@@ -0,0 +1,67 @@
+import numpy as np
+from scipy import sparse
+
+
+# Builds a sparse incidence matrix of shape (haplotypes, individuals): number of chromosome copies of the haplotype carried by every individual
+# haplotype_individuals: for each haplotype, an array of individual indices (one entry per chromosome copy)
+def haplotype_incidence(haplotype_individuals, indiv_count):
+    lengths = [len(individuals) for individuals in haplotype_individuals]
+    rows = np.repeat(np.arange(len(haplotype_individuals)), lengths)
+    cols = (
+        np.concatenate(haplotype_individuals).astype(np.int64)
+        if sum(lengths) > 0
+        else np.zeros(0, dtype=np.int64)
+    )
+
+    # duplicate entries (both copies of the same individual) are summed up
+    return sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.int64), (rows, cols)),
+        shape=(len(haplotype_individuals), indiv_count),
+    )
+
+
+# Computes the frequency of every haplotype within groups of individuals (e.g., populations), all haplotypes and groups at once.
+# The incidence matrix is multiplied by a one-hot matrix assigning individuals to groups -> counts of copies per haplotype and group.
+# input:
+# incidence: sparse matrix of shape (haplotypes, individuals), as returned by haplotype_incidence
+# group_codes: group code of every individual
+# is_male: boolean array, True for male individuals
+# hemizygous: boolean array, True for haplotypes where males carry only one copy (X chromosome outside of PARs)
+# returns: list of strings in the format 'GROUP1:freq1;GROUP2:freq2', groups with non-zero counts only, sorted by the group code
+def group_frequencies(incidence, group_codes, is_male, hemizygous):
+    group_names, group_idx = np.unique(np.asarray(group_codes, dtype=str), return_inverse=True)
+    group_idx = group_idx.reshape(-1)
+    indiv_count = len(group_idx)
+
+    onehot = sparse.csr_matrix(
+        (np.ones(indiv_count, dtype=np.int64), (np.arange(indiv_count), group_idx)),
+        shape=(indiv_count, len(group_names)),
+    )
+    counts = (incidence @ onehot).tocsr()
+    counts.sort_indices()
+
+    # number of chromosome copies in each group
+    group_sizes = np.bincount(group_idx, minlength=len(group_names))
+    group_male_sizes = np.bincount(
+        group_idx[np.asarray(is_male, dtype=bool)], minlength=len(group_names)
+    )
+    totals_diploid = group_sizes * 2
+    totals_hemizygous = group_sizes * 2 - group_male_sizes
+
+    result = []
+    for i in range(counts.shape[0]):
+        cols = counts.indices[counts.indptr[i] : counts.indptr[i + 1]]
+        vals = counts.data[counts.indptr[i] : counts.indptr[i + 1]]
+        totals = totals_hemizygous if hemizygous[i] else totals_diploid
+
+        result.append(
+            ";".join(
+                [
+                    group_names[col] + ":{:.5f}".format(val / totals[col])
+                    for col, val in zip(cols.tolist(), vals.tolist())
+                    if totals[col] > 0
+                ]
+            )
+        )
+
+    return result
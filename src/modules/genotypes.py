@@ -0,0 +1,108 @@
+import numpy as np
+
+MISSING_ALLELE = -1  # allele index used for missing values ('.')
+
+TAB = ord("\t")
+DOT = ord(".")
+ZERO = ord("0")
+NINE = ord("9")
+HAPLOID = 0  # separator value of haploid genotypes (single allele)
+
+
+# check if all the genotypes in the block are diploid with single-digit alleles (e.g., '0|1' or './.'),
+# i.e., every genotype takes exactly 4 bytes including the tab
+def is_simple_block(data):
+    if len(data) % 4 != 3:
+        return False
+
+    alleles = np.concatenate((data[0::4], data[2::4]))
+    separators = data[1::4]
+
+    return (
+        bool(np.all(data[3::4] == TAB))
+        and bool(np.all((separators == ord("|")) | (separators == ord("/"))))
+        and bool(np.all(((alleles >= ZERO) & (alleles <= NINE)) | (alleles == DOT)))
+    )
+
+
+# Decodes a block of tab-separated genotypes (e.g., b'0|1\t2|0') into an array of allele indices of shape (samples, 2),
+# missing alleles are MISSING_ALLELE. Additional FORMAT fields after the GT (e.g., '0|1:35') are ignored.
+# Returns the allele array and an array of separators (ASCII codes, HAPLOID if only one allele is given).
+# An empty block (VCF without samples) gives empty arrays.
+def decode_genotypes(genotype_block):
+    data = np.frombuffer(bytes(genotype_block), dtype=np.uint8)
+
+    if len(data) == 0:
+        return np.zeros((0, 2), dtype=np.int16), np.zeros(0, dtype=np.uint8)
+
+    # most common case -> decode the whole block at once
+    if is_simple_block(data):
+        alleles = np.stack((data[0::4], data[2::4]), axis=1).astype(np.int16) - ZERO
+        alleles[alleles == (DOT - ZERO)] = MISSING_ALLELE
+        return alleles, data[1::4].copy()
+
+    # general case: multi-digit allele indices, haploid genotypes, additional FORMAT fields
+    genotypes = bytes(genotype_block).decode().split("\t")
+    alleles = np.full((len(genotypes), 2), MISSING_ALLELE, dtype=np.int16)
+    separators = np.full(len(genotypes), HAPLOID, dtype=np.uint8)
+
+    for i, gt in enumerate(genotypes):
+        gt = gt.split(":", 1)[0]
+        sep = "|" if "|" in gt else "/"
+        gt_alleles = gt.split(sep)
+
+        if len(gt_alleles) > 1:
+            separators[i] = ord(sep)
+        for j, allele in enumerate(gt_alleles[:2]):
+            if allele != ".":
+                alleles[i, j] = int(allele)
+
+    return alleles, separators
+
+
+# Encodes an array of allele indices and separators (as returned by decode_genotypes) back into a block of tab-separated genotypes.
+def encode_genotypes(alleles, separators):
+    if len(alleles) == 0:
+        return b""
+
+    # most common case -> encode the whole block at once
+    if (
+        bool(np.all(separators != HAPLOID))
+        and bool(np.all(alleles <= 9))
+        and bool(np.all(alleles >= MISSING_ALLELE))
+    ):
+        data = np.full(len(alleles) * 4 - 1, TAB, dtype=np.uint8)
+        data[0::4] = np.where(alleles[:, 0] == MISSING_ALLELE, DOT, alleles[:, 0] + ZERO)
+        data[1::4] = separators
+        data[2::4] = np.where(alleles[:, 1] == MISSING_ALLELE, DOT, alleles[:, 1] + ZERO)
+        return data.tobytes()
+
+    genotypes = []
+    for gt_alleles, sep in zip(alleles.tolist(), separators.tolist()):
+        gt_alleles = [("." if a == MISSING_ALLELE else str(a)) for a in gt_alleles]
+        if sep == HAPLOID:
+            genotypes.append(gt_alleles[0])
+        else:
+            genotypes.append(chr(sep).join(gt_alleles))
+
+    return "\t".join(genotypes).encode()
+
+
+# Splits the genotypes of a multi-allelic VCF entry into one genotype block for each alternative allele.
+# In the block of the k-th alternative allele, allele k becomes 1, the reference and all the other alternative alleles become 0.
+# The genotype block is decoded only once, there is no limit on the number of alleles.
+def split_genotypes(genotype_block, allele_count):
+    # no samples -> nothing to split
+    if len(genotype_block) == 0:
+        return [b""] * allele_count
+
+    alleles, separators = decode_genotypes(genotype_block)
+    missing = alleles == MISSING_ALLELE
+
+    result = []
+    for allele_idx in range(1, allele_count + 1):
+        allele_alleles = (alleles == allele_idx).astype(np.int16)
+        allele_alleles[missing] = MISSING_ALLELE
+        result.append(encode_genotypes(allele_alleles, separators))
+
+    return result
@@ -1,12 +1,13 @@
+import numpy as np
 import pandas as pd
-import bisect
 from multiprocessing import Pool
+from modules.frequencies import haplotype_incidence, group_frequencies
+from modules.variant_store import format_change
+from modules.common import map_by_cost
 
 result_columns = [
     "TranscriptID",
-    "Changes",
-    "AlleleFrequencies",
-    "VCF_IDs",
+    "Variants",  # rows of the variant store with the alternative allele, sorted by position, empty for the reference haplotype
     "Count",
     "Samples",
 ]
@@ -73,12 +74,37 @@ def remove_conflicting_mutations(changes, AFs):
     return result_kept, result_removed
 
 
-# Creates a list of observed haplotypes from VCF files (individual file for each transcript, with phased genotypes).
+# Finds the distinct haplotypes among the chromosome copies.
+# The alleles of every copy are bit-packed, so that identical copies are found by a single np.unique over the packed rows.
+# input: uint8 matrix of shape (copies, variants), 1 if the alternative allele is present on the copy
+# returns: list of distinct haplotypes (array of variant indices with the alternative allele),
+# and for each haplotype, the indices of the copies carrying it (in the original order)
+def enumerate_haplotypes(copy_haplotypes):
+    variant_count = copy_haplotypes.shape[1]
+    packed = np.packbits(copy_haplotypes, axis=1)
+
+    unique_packed, inverse = np.unique(packed, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # group the copies by haplotype, keep the original order within the group
+    copy_order = np.argsort(inverse, kind="stable")
+    group_ends = np.cumsum(np.bincount(inverse, minlength=len(unique_packed)))
+    haplotype_copies = np.split(copy_order, group_ends[:-1])
+
+    haplotypes = [
+        np.flatnonzero(row)
+        for row in np.unpackbits(unique_packed, axis=1, count=variant_count)
+    ]
+
+    return haplotypes, haplotype_copies
+
+
+# Creates a list of observed haplotypes from the VCF entries (with phased genotypes) assigned to each transcript in the VariantStore.
 # Returns a dataframe, haplotypes described by DNA location, reference and alternative allele.
 def get_gene_haplotypes(
     all_transcripts,
     indiv_ids,
-    tmp_dir,
+    variant_store,
     log_file,
     threads,
     is_X_chrom,
@@ -92,9 +118,6 @@ def get_gene_haplotypes(
         {}
     )  # Dict giving the list of removed samples by transcript (samples are removed if there are conflicting mutations found)
     indiv_count = 0  # number of individuals in the dataset
-    x_autosomal_transcripts = (
-        []
-    )  # list of transcripts in the pseudo-autosomal region (PAR), only applicable for X chromosome
 
     # the VCF dataframes all have the same columns -> store the IDs (colnames) of included infividuals:
     indiv_count = len(indiv_ids)
@@ -102,38 +125,18 @@ def get_gene_haplotypes(
     # keep the sample metadata only for the samples that are in the VCF file - important for frequencies
     sample_info = sample_info[sample_info["Sample name"].isin(indiv_ids)]
 
-    # number of samples in each population
-    pop_counts = (
-        sample_info[["Population code", "Sample name"]]
-        .groupby("Population code")
-        .count()
-    )
-    pop_counts_male = (
-        sample_info[sample_info["Sex"] == "male"][["Population code", "Sample name"]]
-        .groupby("Population code")
-        .count()
-    )
+    sample_info.set_index("Sample name", inplace=True)
 
-    superpop_counts = (
-        sample_info[["Superpopulation code", "Sample name"]]
-        .groupby("Superpopulation code")
-        .count()
-    )
-    superpop_counts_male = (
-        sample_info[sample_info["Sex"] == "male"][
-            ["Superpopulation code", "Sample name"]
-        ]
-        .groupby("Superpopulation code")
-        .count()
-    )
+    is_male = (sample_info.loc[indiv_ids, "Sex"] == "male").to_numpy()
+    male_samples = [sampleID for sampleID, male in zip(indiv_ids, is_male) if male]
 
-    sample_info.set_index("Sample name", inplace=True)
+    # chromosome copies of all the individuals, in the order of the haplotype matrix rows
+    sample_cols = [variant_store.sample_index[indiv] for indiv in indiv_ids]
+    copy_labels = [indiv + ":" + copy for indiv in indiv_ids for copy in ["1", "2"]]
 
-    male_samples = [
-        sampleID
-        for sampleID in indiv_ids
-        if (sample_info.loc[sampleID]["Sex"] == "male")
-    ]
+    # outside the PARs of the X chromosome, the second copy of male individuals is excluded
+    x_copy_mask = np.stack((np.ones(indiv_count, dtype=bool), ~is_male), axis=1).reshape(-1)
+    x_copy_index = np.flatnonzero(x_copy_mask)
 
     global get_haplotypes
 
@@ -149,34 +152,34 @@ def get_gene_haplotypes(
             or ((transcript.start >= PAR2_from) and (transcript.end > PAR2_from))
         )
 
-        # load the according VCF file to Pandas
-        vcf_df = pd.read_csv(tmp_dir + "/" + transcriptID + ".tsv", sep="\t")
+        # rows of the VCF entries in this transcript
+        vcf_rows = variant_store.transcript_records(transcriptID)
 
         # no variation in this transcript -> store reference haplotype only
-        if len(vcf_df) == 0:
+        if len(vcf_rows) == 0:
             return [
                 {
                     "id": transcriptID,
-                    "data": [transcriptID, "REF", "", "", indiv_count * 2, "all"],
+                    "data": [transcriptID, (), indiv_count * 2, "all"],
+                    "copies": None,
                     "removed_samples": [],
                     "autosomal": is_autosomal,
                 }
             ]
 
-        haplo_combinations = []
-        haplo_samples = []
         removed_haplo_samples = []
 
-        # check the combination for every individual
-        for indiv in indiv_ids:
+        # genotypes of all the samples in every row, shape (variants, samples, 2)
+        row_genotypes = variant_store.genotype_matrix[vcf_rows]
 
-            # store indices of rows for which the alternative allele has been found -> create a temporary string ID of the haplotype
-            vals = vcf_df[indiv].to_list()
+        # sanity check - correct separator between paternal / maternal chromosome
+        unphased_rows = {}  # sample column -> indices of rows with unphased genotypes
+        for i, row_idx in enumerate(vcf_rows):
+            for sample_col in variant_store.unphased.get(row_idx, ()):
+                unphased_rows.setdefault(sample_col, []).append(str(i))
 
-            # sanity check - correct separator between paternal / maternal chromosome
-            err_rows = ",".join(
-                [str(i) for i, elem in enumerate(vals) if "|" not in elem]
-            )
+        for indiv, sample_col in zip(indiv_ids, sample_cols):
+            err_rows = ",".join(unphased_rows.get(sample_col, []))
 
             if len(err_rows) > 1:
                 print(
@@ -189,80 +192,43 @@ def get_gene_haplotypes(
                     transcriptID,
                 )
 
-            hap1 = ",".join(
-                [str(i) for i, elem in enumerate(vals) if elem.startswith("1|")]
-            )
-            hap2 = None
-            if is_autosomal or (
-                indiv not in male_samples
-            ):  # males have alleles for the X chromosome specified on the first copy, second copy is always 0
-                hap2 = ",".join(
-                    [str(i) for i, elem in enumerate(vals) if elem.endswith("|1")]
-                )
+        # one row for every chromosome copy (indiv:1, indiv:2, ...), shape (copies, variants)
+        # males have alleles for the X chromosome specified on the first copy, second copy is not counted
+        copy_haplotypes = (
+            row_genotypes[:, sample_cols, :].transpose(1, 2, 0).reshape(-1, len(vcf_rows))
+        )
+        if not is_autosomal:
+            copy_haplotypes = copy_haplotypes[x_copy_mask]
+            copies = x_copy_index
+        else:
+            copies = np.arange(len(copy_labels))
 
-            # no alternative alleles -> reference haplotype
-            if hap1 == "":
-                hap1 = "REF"
-            if hap2 == "":
-                hap2 = "REF"
-
-            # find if this haplotype has been identified before
-            # if so, add this individual to the list, otherwise add new haoplotype
-            nearest_idx = bisect.bisect_left(haplo_combinations, hap1)
-            if (
-                len(haplo_combinations) > nearest_idx
-                and haplo_combinations[nearest_idx] == hap1
-            ):
-                haplo_samples[nearest_idx].append(indiv + ":1")
-            else:
-                haplo_combinations.insert(nearest_idx, hap1)
-                haplo_samples.insert(nearest_idx, [indiv + ":1"])
-
-            if hap2 is not None:
-                nearest_idx = bisect.bisect_left(haplo_combinations, hap2)
-                if (
-                    len(haplo_combinations) > nearest_idx
-                    and haplo_combinations[nearest_idx] == hap2
-                ):
-                    haplo_samples[nearest_idx].append(indiv + ":2")
-                else:
-                    haplo_combinations.insert(nearest_idx, hap2)
-                    haplo_samples.insert(nearest_idx, [indiv + ":2"])
+        haplotypes, haplotype_copies = enumerate_haplotypes(copy_haplotypes)
+
+        # temporary string ID of the haplotype: indices of rows for which the alternative allele has been found
+        # no alternative alleles -> reference haplotype
+        haplo_ids = [
+            (",".join([str(i) for i in haplotype]) if len(haplotype) > 0 else "REF")
+            for haplotype in haplotypes
+        ]
+        haplo_order = sorted(range(len(haplo_ids)), key=lambda i: haplo_ids[i])
+
+        haplo_combinations = [haplo_ids[i] for i in haplo_order]
+        haplo_copies = [copies[haplotype_copies[i]] for i in haplo_order]
+        haplo_samples = [
+            [copy_labels[copy_idx] for copy_idx in copy_indices]
+            for copy_indices in haplo_copies
+        ]
 
         # once all individuals in this VCF have been processed -> summarize observed haplotypes, compute worldwide frequencies
         for i, combination in enumerate(haplo_combinations):
             if combination == "REF":
-                changes_str = "REF"
-                AFs_str = ""
-                combination = ""
-                # removed_str = ""
-                vcf_IDs = []
+                haplotype_variants = ()
 
             else:
-                indexes = [int(idx) for idx in combination.split(",")]
-                changes = []  # changes in the POS:REF>ALT formatk
-                changelist = []  # changes with the POS, REF and ALT fields sepatared
-                AFs = []  # allele frequencies
-                vcf_IDs = []  # IDs in the VCF file
-
-                for idx in indexes:
-                    row = vcf_df.iloc[idx]
-
-                    vcf_IDs.append(str(row["ID"]))
-
-                    changelist.append([row["POS"], row["REF"], row["ALT"]])
-                    changes.append(
-                        str(row["POS"]) + ":" + row["REF"] + ">" + row["ALT"]
-                    )
-                    if "AF" in row["INFO"]:
-                        AFs.append(
-                            row["INFO"]
-                            .split("AF=")[1]
-                            .split(";")[0]
-                            .split(maxsplit=1)[0]
-                        )
-                    else:
-                        AFs.append("-1")
+                # rows of the variant store for which the alternative allele has been found
+                haplotype_variants = [vcf_rows[int(idx)] for idx in combination.split(",")]
+                changelist = [variant_store.variant(row_idx) for row_idx in haplotype_variants]
 
                 # check for conflicting mutations! -> remove these samples from analysis if conflicts found
                 changes_enum = [
@@ -283,29 +249,25 @@ def get_gene_haplotypes(
                 # kept, removed = remove_conflicting_mutations(changelist, AFs)
                 # removedChanges = [ changes[i] for i in removed ]
                 # changelist = [ changelist[i] for i in kept ]
-                # changes = [ changes[i] for i in kept ]
-                # AFs = [ AFs[i] for i in kept ]
 
                 # sort the changes according to the position
-                zipped = list(zip(changelist, changes, AFs))
-                zipped.sort(key=lambda x: int(x[0][0]))
-                changelist, changes, AFs = zip(*zipped)
-
-                # removed_str = ';'.join(removedChanges)
-                changes_str = ";".join(changes)
-                AFs_str = ";".join(AFs)
+                haplotype_variants = tuple(
+                    row_idx
+                    for _, row_idx in sorted(
+                        zip(changelist, haplotype_variants), key=lambda x: x[0].POS
+                    )
+                )
 
             result_local.append(
                 {
                     "id": transcriptID,
                     "data": [
                         transcriptID,
-                        changes_str,
-                        AFs_str,
-                        ";".join(vcf_IDs),
+                        haplotype_variants,
                         len(haplo_samples[i]),
                         ";".join(haplo_samples[i]),
                     ],
+                    "copies": haplo_copies[i],
                     "removed_samples": removed_haplo_samples,
                     "autosomal": is_autosomal,
                 }
@@ -313,118 +275,66 @@ def get_gene_haplotypes(
 
         return result_local
 
+    # assemble the genotype matrix before starting the workers -> shared by all the processes
+    variant_store.genotype_matrix
+
+    # estimated cost of every transcript: number of variants (the number of chromosome copies is the same for all)
+    costs = [
+        len(variant_store.transcript_records(transcript.id)) for transcript in all_transcripts
+    ]
+
     with Pool(threads) as p:
-        aggregated_results = p.map(get_haplotypes, all_transcripts)
+        aggregated_results = map_by_cost(p, get_haplotypes, all_transcripts, costs)
     # aggregated_results = list(map(get_haplotypes, all_transcripts))
 
+    haplotype_individuals = []  # individuals (indices in indiv_ids) carrying each haplotype, one entry per copy
+    hemizygous = []  # males carry only one copy of the haplotype (X chromosome outside of PARs)
+
     for processed_transcript in aggregated_results:
         for elem in processed_transcript:
             result_data.append(elem["data"])
+            hemizygous.append(is_X_chrom and not elem["autosomal"])
 
-            removed_samples[elem["id"]] = elem["removed_samples"]
-
-            if is_X_chrom and elem["autosomal"]:
-                x_autosomal_transcripts.append(elem["id"])
-
-    result_df = pd.DataFrame(columns=result_columns, data=result_data)
-
-    # count frequencies taking into account the number of removed samples in the transcript, and sex in case of X chromosome
-    def count_freq(row):
-        id = row["TranscriptID"]
-        # removed_count = len(removed_samples[id])
-        total_count = 0
-
-        if is_X_chrom and (id not in x_autosomal_transcripts):
-            male_count = len(male_samples)
-            total_count = male_count + (
-                (indiv_count - male_count) * 2
-            )  # - removed_count
-        else:
-            total_count = indiv_count * 2  # - removed_count
-
-        if total_count == 0:
-            return 0
-
-        return row["Count"] / total_count
-
-    # count the occurrences of this haplotype within populations and superpopulations
-    def count_freq_pop(row):
-        populations = {}
-
-        if row["Samples"] == "all":
-            return "-"
-
-        for s in row["Samples"].split(";"):
-            pop_code = sample_info.loc[s.split(":", 1)[0]]["Population code"]
-
-            if pop_code in populations:
-                populations[pop_code] += 1
-            else:
-                populations[pop_code] = 1
-
-        id = row["TranscriptID"]
-        result = []
-
-        for pop_code in populations:
-            pop_indiv_count = pop_counts.loc[pop_code]["Sample name"]
-            pop_total_count = 0
-            pop_freq = 0
-
-            if is_X_chrom and (id not in x_autosomal_transcripts):
-                pop_male_count = pop_counts_male.loc[pop_code]["Sample name"]
-                pop_total_count = pop_male_count + (
-                    (pop_indiv_count - pop_male_count) * 2
-                )
-            else:
-                pop_total_count = pop_indiv_count * 2
-
-            if pop_total_count > 0:
-                pop_freq = populations[pop_code] / pop_total_count
-                result.append(pop_code + ":{:.5f}".format(pop_freq))
-
-        return ";".join(result)
-
-    def count_freq_superpop(row):
-        superpop = {}
-
-        if row["Samples"] == "all":
-            return "-"
-
-        for s in row["Samples"].split(";"):
-            superpop_code = sample_info.loc[s.split(":", 1)[0]]["Superpopulation code"]
-
-            if superpop_code in superpop:
-                superpop[superpop_code] += 1
+            if elem["copies"] is None:
+                haplotype_individuals.append(np.zeros(0, dtype=np.int64))
             else:
-                superpop[superpop_code] = 1
+                haplotype_individuals.append(elem["copies"] // 2)
 
-        id = row["TranscriptID"]
-        result = []
-
-        for pop_code in superpop:
-            pop_indiv_count = superpop_counts.loc[pop_code]["Sample name"]
-            pop_total_count = 0
-            pop_freq = 0
+            removed_samples[elem["id"]] = elem["removed_samples"]
 
-            if is_X_chrom and (id not in x_autosomal_transcripts):
-                pop_male_count = superpop_counts_male.loc[pop_code]["Sample name"]
-                pop_total_count = pop_male_count + (
-                    (pop_indiv_count - pop_male_count) * 2
-                )
-            else:
-                pop_total_count = pop_indiv_count * 2
+    result_df = pd.DataFrame(columns=result_columns, data=result_data)
 
-            if pop_total_count > 0:
-                pop_freq = superpop[pop_code] / pop_total_count
-                result.append(pop_code + ":{:.5f}".format(pop_freq))
+    # count frequencies taking into account the sex in case of X chromosome
+    male_count = len(male_samples)
+    hemizygous = np.array(hemizygous, dtype=bool)
+    total_counts = np.where(
+        hemizygous, male_count + ((indiv_count - male_count) * 2), indiv_count * 2
+    )
+    result_df["Frequency"] = np.divide(
+        result_df["Count"].to_numpy(dtype=np.float64),
+        total_counts,
+        out=np.zeros(len(result_df)),
+        where=(total_counts > 0),
+    )
 
-        return ";".join(result)
+    # count the occurrences of haplotypes within populations and superpopulations
+    incidence = haplotype_incidence(haplotype_individuals, indiv_count)
+    all_samples = (result_df["Samples"] == "all").to_numpy()
+
+    for colname, code_colname in [
+        ("Frequency_population", "Population code"),
+        ("Frequency_superpopulation", "Superpopulation code"),
+    ]:
+        group_freqs = group_frequencies(
+            incidence,
+            sample_info.loc[indiv_ids, code_colname].tolist(),
+            is_male,
+            hemizygous,
+        )
+        result_df[colname] = [
+            ("-" if is_all else freqs) for freqs, is_all in zip(group_freqs, all_samples)
+        ]
 
-    result_df["Frequency"] = result_df.apply(count_freq, axis=1)
-    result_df["Frequency_population"] = result_df.apply(count_freq_pop, axis=1)
-    result_df["Frequency_superpopulation"] = result_df.apply(
-        count_freq_superpop, axis=1
-    )
     # result_df.sort_values(by=['TranscriptID', 'Frequency'], ascending=[True, False], inplace=True)
 
     # write info about the removed samples into the log file
@@ -442,4 +352,38 @@ def get_gene_haplotypes(
         )
     log_file_handle.close()
 
+    # variants found in the haplotypes, accessed by the row of the variant store
+    variants = {
+        row_idx: variant_store.variant(row_idx)
+        for haplotype_variants in result_df["Variants"]
+        for row_idx in haplotype_variants
+    }
+
+    return result_df, variants
+
+
+# Formats the haplotype table for the output CSV: the list of variants of every haplotype is replaced by
+# the changes (POS:REF>ALT), allele frequencies and VCF IDs as strings separated by ';' ('REF' for the reference haplotype)
+def format_haplotypes(haplotypes_df, variants):
+    result_df = haplotypes_df.drop(columns=["Variants"])
+
+    haplotypes = [
+        [variants[row_idx] for row_idx in haplotype_variants]
+        for haplotype_variants in haplotypes_df["Variants"]
+    ]
+    result_df.insert(
+        1,
+        "Changes",
+        [
+            (";".join([format_change(var) for var in haplotype]) if len(haplotype) > 0 else "REF")
+            for haplotype in haplotypes
+        ],
+    )
+    result_df.insert(
+        2, "AlleleFrequencies", [";".join([var.AF for var in haplotype]) for haplotype in haplotypes]
+    )
+    result_df.insert(
+        3, "VCF_IDs", [";".join([var.ID for var in haplotype]) for haplotype in haplotypes]
+    )
+
     return result_df
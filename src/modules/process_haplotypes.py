@@ -1,16 +1,18 @@
 import os
-import re
 from multiprocessing import Pool
 import pandas as pd
-import bisect
-from Bio.Seq import Seq
+from collections import namedtuple
 from modules.coordinates_toolbox import (
-    get_rna_position,
-    get_rna_position_simple,
+    CoordinateMapper,
     check_start_change,
     get_affected_codons,
 )
-from modules.common import KeyWrapper
+from modules.cdna_editor import apply_changes
+from modules.cdna_export import CdnaExport
+from modules.common import SequenceRegistry, map_by_cost
+from modules.consequence_cache import get_variant_effect
+from modules.variant_store import format_change
+from modules.translation import translate_frames, translate_mutated
 
 result_columns = [
     "TranscriptID",  # transcript stable ID from Ensembl
@@ -37,6 +39,20 @@ result_columns = [
     #    'samples'                   # samples containing this haplotype (in the format SAMPLE_ID:1 for maternal copy, SAMPLE_ID:2 for paternal copy) - not used currently, too large
 ]
 
+# columns of the haplotype table used to process a haplotype, Index is the row index (used in the haplotype ID)
+HaplotypeRow = namedtuple(
+    "HaplotypeRow",
+    [
+        "Index",
+        "TranscriptID",
+        "Variants",
+        "Count",
+        "Frequency",
+        "Frequency_population",
+        "Frequency_superpopulation",
+    ],
+)
+
 
 # create dummy empty files in case of empty input
 def empty_output(output_file, output_fasta):
@@ -84,8 +100,8 @@ def add_population_freqs(left, right):
 def process_haplotypes(
     all_transcripts,
     genes_haplo_df,
+    variants,
     all_cdnas,
-    annotations_db,
     chromosome,
     id_prefix,
     force_rf,
@@ -95,12 +111,26 @@ def process_haplotypes(
     min_count=0,
     ignore_UTR=True,
     skip_start_loss=True,
+    export_cdna=True,
+    consequence_cache=None,
 ):
     result_data = []
 
+    # mutated cDNA of the haplotypes -> written by the workers into cDNA_res/<chr>.fa.gz
+    cdna_export = None
+    if export_cdna:
+        cdna_folder = folder_res + "/cDNA_res/"
+        if not os.path.exists(cdna_folder):
+            os.mkdir(cdna_folder)
+        cdna_export = CdnaExport(cdna_folder + chromosome + ".fa.gz")
+        cdna_export.prepare()
+
     global process_transcript_haplotypes
 
-    def process_transcript_haplotypes(transcript_feature):
+    # transcript_haplotypes: rows of the haplotype table for this transcript, as named tuples
+    # transcript_variants: variants found in these haplotypes, accessed by the row of the variant store
+    def process_transcript_haplotypes(task):
+        transcript_feature, transcript_haplotypes, transcript_variants = task
         transcript_id = transcript_feature.id
 
         # Check if we have the cDNA sequence in the fasta
@@ -108,70 +138,66 @@ def process_haplotypes(
             print("Transcript", transcript_id, "not in cDNA database, skipping!")
             return []
 
-        exons = [
-            exon
-            for exon in annotations_db.children(
-                transcript_feature, featuretype="exon", order_by="start"
-            )
-        ]
-        start_codons = [
-            sc
-            for sc in annotations_db.children(
-                transcript_feature, featuretype="start_codon", order_by="start"
-            )
-        ]  # there should be only one, but just in case...
-        stop_codons = [
-            sc
-            for sc in annotations_db.children(
-                transcript_feature, featuretype="stop_codon", order_by="start"
-            )
-        ]  # not in use currently
-        biotype = ""
-        try:
-            biotype = transcript_feature["transcript_biotype"][0]
-        except:
-            biotype = "-"
+        # annotation features of this transcript, read beforehand
+        mapper = CoordinateMapper.from_transcript(transcript_feature)
+        biotype = transcript_feature.biotype
 
         # Some transcripts are classified as not coding -> start and stop codon positions are not given
-        start_codon = None
-        stop_codon = None
-
-        if len(start_codons) > 0:
-            start_codon = start_codons[0]
-        if len(stop_codons) > 0:
-            stop_codon = stop_codons[0]
+        start_codon = transcript_feature.start_codon
+        stop_codon = transcript_feature.stop_codon
+
+        # positions of the start and stop codon in the cDNA (-1 if not annotated or not in an exon), mapped once for all haplotypes of the transcript
+        codon_locations = mapper.rna_positions(
+            [
+                codon.start if codon is not None else -1
+                for codon in (start_codon, stop_codon)
+            ]
+        ).tolist()
 
         current_transcript = {
             "ID": transcript_id,
             "feature": transcript_feature,
-            "exons": exons,
+            "mapper": mapper,
             "start_codon": start_codon,
             "stop_codon": stop_codon,
+            "codon_locations": codon_locations,
             "fasta_element": all_cdnas[transcript_id.split(".")[0]],
             "biotype": biotype,
         }
-        transcript_haplotypes = genes_haplo_df[
-            genes_haplo_df["TranscriptID"] == transcript_id
-        ]
 
         local_result_data = {}
         local_result_sequences = (
+            SequenceRegistry()
+        )  # way to avoid duplicate sequences -> access sequences by digest, aggregate haplotype IDs that correspond
+        mutated_cdnas = (
             []
-        )  # way to avoid duplicate sequences -> access sequences by hash, aggregate haplotype IDs that correspond
-        dico_mutated_cDNA = (
+        )  # all cDNA with their respective mutation (haplotype ID, sequence) -> Usefull to extract ncRNA mutated sequence
+        variant_effects = (
+            {}
+        )  # effects of individual variants on the cDNA, shared by all haplotypes of the transcript
+        ref_codons = (
             {}
-        )  # Dict that contain all cDNA with their respective mutation -> Usefull to extract ncRNA mutated sequence
+        )  # residues affected by a change in the reference protein, accessed by (variant, reading_frame_ref, protein_start_ref)
+        reference_frames = translate_frames(
+            current_transcript["fasta_element"]["sequence"]
+        )  # translation of the reference cDNA in all three reading frames, reused for the unchanged parts of the haplotypes
+        cached_effects = (
+            consequence_cache.transcript_effects(
+                transcript_feature.id,
+                len(current_transcript["fasta_element"]["sequence"]),
+            )
+            if consequence_cache is not None
+            else {}
+        )  # effects of variants computed before (by ProVar or a previous run), accessed by (POS, REF, ALT)
+        new_effects = {}  # effects computed here, to be added to the cache
 
-        for index, row in transcript_haplotypes.iterrows():
-            transcript_id = row["TranscriptID"].split(".")[0]
+        for row in transcript_haplotypes:
+            index = row.Index
+            transcript_id = row.TranscriptID.split(".")[0]
 
             cdna_sequence = current_transcript["fasta_element"][
                 "sequence"
             ]  # reference cDNA
-            mutated_cdna = Seq(cdna_sequence)  # cDNA to aggregate mutations
-
-            sequence_length_diff = 0  # cummulative difference between the length of reference and haplotype -> to place mutations correctly in case of preceding indels
-
             # boolean - are we on a reverse strand?
             reverse_strand = current_transcript["feature"].strand == "-"
 
@@ -204,11 +230,14 @@ def process_haplotypes(
 
             # Get the reading frame from the length between the start of the transcript and the start codon
             if current_transcript["start_codon"] is not None:
-                start_loc = get_rna_position_simple(
-                    transcript_id,
-                    current_transcript["start_codon"].start,
-                    current_transcript["exons"],
-                )
+                start_loc = current_transcript["codon_locations"][0]
+                if start_loc == -1:
+                    raise Exception(
+                        current_transcript["ID"]
+                        + ": DNA location "
+                        + str(current_transcript["start_codon"].start)
+                        + " is not in an exon."
+                    )
                 if reverse_strand:
                     start_loc = len(cdna_sequence) - start_loc - 3
 
@@ -219,26 +248,25 @@ def process_haplotypes(
 
             # Alternatively, use the stop codon in the same way, assume start at codon 0
             elif (current_transcript["stop_codon"] is not None) and force_rf:
-                stop_loc = get_rna_position_simple(
-                    transcript_id,
-                    current_transcript["stop_codon"].start,
-                    current_transcript["exons"],
-                )
+                stop_loc = current_transcript["codon_locations"][1]
+                if stop_loc == -1:
+                    raise Exception(
+                        current_transcript["ID"]
+                        + ": DNA location "
+                        + str(current_transcript["stop_codon"].start)
+                        + " is not in an exon."
+                    )
                 if reverse_strand:
                     stop_loc = len(cdna_sequence) - stop_loc - 3
 
                 reading_frame = stop_loc % 3
                 reading_frame_ref = reading_frame
 
-            all_changes = row["Changes"].split(";")
-            all_AFs = row["AlleleFrequencies"].split(";")
-            all_vcf_IDs = row["VCF_IDs"].split(";")
+            all_variants = list(row.Variants)  # rows of the variant store, sorted by position
             if (
                 reverse_strand
             ):  # revert the order of mutations in the reverse strand, so that we add them from start to end and account for preceding indels
-                all_AFs.reverse()
-                all_changes.reverse()
-                all_vcf_IDs.reverse()
+                all_variants.reverse()
 
             ref_alleles = []
             alt_alleles = []
@@ -247,30 +275,26 @@ def process_haplotypes(
             validity_check = True
 
             # Check if any mutations are present
-            if row["Changes"] == "REF":
+            if len(all_variants) == 0:
                 continue
             # iterate through changes first time, check if start codon is lost,
             # adjust the position of the start codon if shifted (i.e. inframe indel in 5' UTR)
             # remember alleles, locations on DNA and RNA
-            for change in all_changes:
-                ref_allele = re.split("\d+", change)[1].split(">")[0][1:]
-                alt_allele = re.split("\d+", change)[1].split(">")[1]
-
-                # in case the allele is fully deleted
-                if ref_allele == "-":
-                    ref_allele = Seq("")
-                else:
-                    ref_allele = Seq(ref_allele)
-
-                if alt_allele == "-":
-                    alt_allele = Seq("")
-                else:
-                    alt_allele = Seq(alt_allele)
-
-                dna_location = int(re.split("[a-zA-Z\*]+", change)[0][:-1])
-
-                # compute the location in the RNA sequence
-                # does any of the allele sequences intersect a splicing site? => truncate if so
+            for variant_idx in all_variants:
+                # the effect of the variant on its own is the same in every haplotype of this transcript -> computed only once
+                if variant_idx not in variant_effects:
+                    variant = transcript_variants[variant_idx]
+                    variant_key = (variant.POS, variant.REF, variant.ALT)
+                    if variant_key in cached_effects:
+                        variant_effects[variant_idx] = cached_effects[variant_key]
+                    else:
+                        variant_effects[variant_idx] = get_variant_effect(
+                            variant,
+                            current_transcript["mapper"],
+                            len(cdna_sequence),
+                            reverse_strand,
+                        )
+                        new_effects[variant_key] = variant_effects[variant_idx]
                 (
                     rna_location,
                     ref_allele,
@@ -278,13 +302,9 @@ def process_haplotypes(
                     alt_allele,
                     alt_len,
                     mutation_intersects_intron,
-                ) = get_rna_position(
-                    transcript_id,
-                    dna_location,
-                    ref_allele,
-                    alt_allele,
-                    current_transcript["exons"],
-                )
+                    frameshift,
+                    dna_var_type,
+                ) = variant_effects[variant_idx]
 
                 # is a splice junction affected? -> remember if so
                 if (mutation_intersects_intron is not None) and (
@@ -292,23 +312,8 @@ def process_haplotypes(
                 ):
                     spl_junctions_affected.append(int(mutation_intersects_intron))
 
-                # boolean - does this introduce a frameshift?
-                frameshifts.append((abs(ref_len - alt_len) % 3) != 0)
-
-                # get the general variant type
-                if mutation_intersects_intron is not None:
-                    dna_var_types.append("splice")
-                elif ref_len == alt_len:
-                    dna_var_types.append("SNP")
-                else:
-                    dna_var_types.append("indel")
-
-                # if we are on a reverse strand, we need to complement the reference and alternative sequence to match the cDNA
-                # we also need to count the position from the end
-                if reverse_strand:
-                    ref_allele = ref_allele.reverse_complement()
-                    alt_allele = alt_allele.reverse_complement()
-                    rna_location = len(cdna_sequence) - rna_location - ref_len
+                frameshifts.append(frameshift)
+                dna_var_types.append(dna_var_type)
 
                 # check if the start codon gets shifted
                 if (current_transcript["start_codon"] is not None) and (
@@ -347,79 +352,58 @@ def process_haplotypes(
             if not validity_check:
                 continue
 
-            # iterate through mutations second time, construct mutated cdna
-            for ch_idx, change in enumerate(all_changes):
-                ref_allele = ref_alleles[ch_idx]
-                alt_allele = alt_alleles[ch_idx]
-
-                ref_len = len(ref_allele)
-                alt_len = len(alt_allele)
-
-                rna_location = rna_locations[ch_idx]
+            # construct the mutated cDNA in a single pass through the changes
+            mutated_cdna, mutated_locations, mismatch_idx = apply_changes(
+                cdna_sequence, rna_locations, ref_alleles, alt_alleles
+            )
 
-                # store change in cDNA
-                cDNA_changes.append(
-                    str(rna_location) + ":" + str(ref_allele) + ">" + str(alt_allele)
+            # check if what we expected to find is in fact in the cDNA
+            if mismatch_idx != -1:
+                # location in the partially mutated cDNA, shifted by the preceding indels
+                rna_location = rna_locations[mismatch_idx] + (
+                    len(mutated_cdna) - len(cdna_sequence)
                 )
+                ref_len = len(ref_alleles[mismatch_idx])
+                print("Ref allele not matching the cDNA sequence, skipping haplotype!")
+                print(
+                    transcript_id
+                    + " strand "
+                    + current_transcript["feature"].strand
+                    + " "
+                    + format_change(transcript_variants[all_variants[mismatch_idx]])
+                    + " cDNA: "
+                    + mutated_cdna[rna_location - 10 : rna_location]
+                    + " "
+                    + mutated_cdna[rna_location : rna_location + ref_len]
+                    + " "
+                    + mutated_cdna[rna_location + ref_len : rna_location + ref_len + 10]
+                )
+                validity_check = False
 
-                # need to readjust the position in the mutated sequence in case there were indels before
-                rna_location += sequence_length_diff
-
-                # check if what we expected to find is in fact in the cDNA
-                if (
-                    str(ref_allele)
-                    != mutated_cdna[rna_location : rna_location + ref_len]
-                ):
-                    print(
-                        "Ref allele not matching the cDNA sequence, skipping haplotype!"
-                    )
-                    print(
-                        transcript_id
-                        + " strand "
-                        + current_transcript["feature"].strand
-                        + " "
-                        + change
-                        + " cDNA: "
-                        + mutated_cdna[rna_location - 10 : rna_location]
-                        + " "
-                        + mutated_cdna[rna_location : rna_location + ref_len]
-                        + " "
-                        + mutated_cdna[
-                            rna_location + ref_len : rna_location + ref_len + 10
-                        ]
-                    )
-                    cDNA_changes = cDNA_changes[
-                        :-1
-                    ]  # remove the element that has already been added
-                    validity_check = False
-                    break
-
-                # apply the change to the cDNA
-                mutated_cdna = (
-                    mutated_cdna[:rna_location]
-                    + alt_allele
-                    + mutated_cdna[rna_location + ref_len :]
+            # store changes in cDNA
+            for ch_idx in range(len(mutated_locations)):
+                cDNA_changes.append(
+                    str(rna_locations[ch_idx])
+                    + ":"
+                    + ref_alleles[ch_idx]
+                    + ">"
+                    + alt_alleles[ch_idx]
                 )
-                sequence_length_diff += alt_len - ref_len
 
             # Save the mutated cDNA
             haplotypeID = id_prefix + "_" + hex(index)[2:]
-            if haplotypeID in dico_mutated_cDNA.keys():
-                raise RuntimeError("Haplotype ID allready present in dico_mutated_cDNA")
-
-            dico_mutated_cDNA[haplotypeID] = mutated_cdna
+            if export_cdna:
+                mutated_cdnas.append((haplotypeID, mutated_cdna))
 
             # skip in case of misaligned change
             if not validity_check:
                 continue
 
             # translate all the individual changes only after all the changes have been added to the mutated cDNA -> cover cases where multiple mutations affect the same codon(s)
-            cdna_sequence = Seq(cdna_sequence)
             has_frameshift = False
-            sequence_length_diff = 0
 
             # iterate third time, remember individual changes on the protein level
-            for ch_idx, change in enumerate(all_changes):
+            for ch_idx, variant_idx in enumerate(all_variants):
                 ref_allele = ref_alleles[ch_idx]
                 alt_allele = alt_alleles[ch_idx]
                 ref_len = len(ref_allele)
@@ -435,16 +419,20 @@ def process_haplotypes(
                 )  # protein consequence in each of the reading frames (e.g., SAV, frameshift, synonymous, etc.)
                 is_synonymous = []
 
-                ref_alleles_protein, protein_location_ref = get_affected_codons(
-                    cdna_sequence,
-                    rna_location,
-                    ref_len,
-                    reading_frame_ref,
-                    protein_start_ref,
-                )
+                # residues affected in the reference protein depend only on the variant and the reference reading frame
+                ref_codons_key = (variant_idx, reading_frame_ref, protein_start_ref)
+                if ref_codons_key not in ref_codons:
+                    ref_codons[ref_codons_key] = get_affected_codons(
+                        cdna_sequence,
+                        rna_location,
+                        ref_len,
+                        reading_frame_ref,
+                        protein_start_ref,
+                    )
+                ref_alleles_protein, protein_location_ref = ref_codons[ref_codons_key]
 
-                # need to readjust the position in the mutated sequence in case there were indels before
-                rna_location += sequence_length_diff
+                # position in the mutated sequence, accounting for preceding indels
+                rna_location = mutated_locations[ch_idx]
 
                 alt_alleles_protein, protein_location_alt = get_affected_codons(
                     mutated_cdna, rna_location, alt_len, reading_frame, protein_start
@@ -507,8 +495,6 @@ def process_haplotypes(
                 all_protein_changes.append("|".join(rf_changes))
                 prot_var_types.append("|".join(rf_conseq))
 
-                sequence_length_diff += alt_len - ref_len
-
             spl_junctions_affected_str = ";".join(
                 [str(x) for x in spl_junctions_affected]
             )
@@ -517,7 +503,16 @@ def process_haplotypes(
 
             # check the reading frame, if possible, and translate
             if reading_frame > -1:
-                protein_seq = mutated_cdna[reading_frame:].transcribe().translate()
+                protein_seq = translate_mutated(
+                    mutated_cdna,
+                    reading_frame,
+                    reference_frames,
+                    len(cdna_sequence),
+                    rna_locations,
+                    ref_alleles,
+                    mutated_locations,
+                    alt_alleles,
+                )
 
                 # since the reading frame is available, we know where the start codon is and it hasn't been lost by a mutation -> we can get rid of the UTRs
                 # we don't filter UTR variants earlier, since changes in the start or stop codon redefine UTR regions in the transcript
@@ -534,16 +529,8 @@ def process_haplotypes(
                         for change in all_protein_changes
                     ]
 
-                    all_vcf_IDs = [
-                        vcf_id
-                        for idx, vcf_id in enumerate(all_vcf_IDs)
-                        if variant_filter[idx]
-                    ]
-                    all_changes = [
-                        ch for idx, ch in enumerate(all_changes) if variant_filter[idx]
-                    ]
-                    all_AFs = [
-                        af for idx, af in enumerate(all_AFs) if variant_filter[idx]
+                    all_variants = [
+                        var for idx, var in enumerate(all_variants) if variant_filter[idx]
                     ]
                     cDNA_changes = [
                         ch for idx, ch in enumerate(cDNA_changes) if variant_filter[idx]
@@ -571,30 +558,33 @@ def process_haplotypes(
                     protein_start = 0
 
                 # check if this haplotype is already in the results
+                all_vcf_IDs = [transcript_variants[var].ID for var in all_variants]
                 haplo_hash = str(hash(";".join(all_vcf_IDs)))
 
                 # if found, merge these two (increase the sample count and frequency)
                 if haplo_hash in local_result_data:
-                    local_result_data[haplo_hash][16] += row["Count"]
-                    local_result_data[haplo_hash][17] += row["Frequency"]
+                    local_result_data[haplo_hash][16] += row.Count
+                    local_result_data[haplo_hash][17] += row.Frequency
                     local_result_data[haplo_hash][18] = add_population_freqs(
-                        local_result_data[haplo_hash][18], row["Frequency_population"]
+                        local_result_data[haplo_hash][18], row.Frequency_population
                     )
                     local_result_data[haplo_hash][19] = add_population_freqs(
                         local_result_data[haplo_hash][19],
-                        row["Frequency_superpopulation"],
+                        row.Frequency_superpopulation,
                     )
                 else:
                     local_result_data[haplo_hash] = [
-                        row["TranscriptID"],
+                        row.TranscriptID,
                         chromosome,
                         current_transcript["biotype"],
                         haplotypeID,
                         ";".join(
                             all_vcf_IDs
                         ),  # could be sorted in reverse order if on reverse strand
-                        ";".join(all_changes),
-                        ";".join(all_AFs),
+                        ";".join(
+                            [format_change(transcript_variants[var]) for var in all_variants]
+                        ),
+                        ";".join([transcript_variants[var].AF for var in all_variants]),
                         ";".join(cDNA_changes),
                         ";".join(all_protein_changes),
                         ";".join(prot_var_types),
@@ -604,86 +594,57 @@ def process_haplotypes(
                         current_transcript["start_codon"] is None,
                         start_lost,
                         spl_junctions_affected_str,
-                        row["Count"],
-                        row["Frequency"],
-                        row["Frequency_population"],
-                        row["Frequency_superpopulation"],
+                        row.Count,
+                        row.Frequency,
+                        row.Frequency_population,
+                        row.Frequency_superpopulation,
                     ]
 
-                    # compute the sequence hash -> check if it already is in the list
-                    # only store the sequence of the haplotype is not already stored
-                    seq_hash = hash(str(protein_seq))
-                    nearest_idx = bisect.bisect_left(
-                        KeyWrapper(local_result_sequences, key=lambda x: x["hash"]),
-                        seq_hash,
+                    # only store the sequence of the haplotype if not already stored, otherwise add the haplotype ID to the existing entry
+                    local_result_sequences.add(
+                        protein_seq,
+                        {"haplotypes": haplotypeID, "rfs": str(reading_frame)},
+                        {"start": protein_start},
                     )
-                    if (
-                        len(local_result_sequences) > nearest_idx
-                        and local_result_sequences[nearest_idx]["hash"] == seq_hash
-                    ):
-                        local_result_sequences[nearest_idx]["haplotypes"].append(
-                            haplotypeID
-                        )
-                        local_result_sequences[nearest_idx]["rfs"].append(
-                            str(reading_frame)
-                        )
-                    else:
-                        local_result_sequences.insert(
-                            nearest_idx,
-                            {
-                                "hash": seq_hash,
-                                "haplotypes": [haplotypeID],
-                                "sequence": protein_seq,
-                                "start": protein_start,
-                                "rfs": [str(reading_frame)],
-                            },
-                        )
 
             # unknown reading frame -> translate in all 3 reading frames
             # not possible to annotate UTRs -> keep everything
             elif len(protein_changes) > 0:
                 for rf in range(0, 3):
-                    protein_seq = mutated_cdna[rf:].transcribe().translate()
+                    protein_seq = translate_mutated(
+                        mutated_cdna,
+                        rf,
+                        reference_frames,
+                        len(cdna_sequence),
+                        rna_locations,
+                        ref_alleles,
+                        mutated_locations,
+                        alt_alleles,
+                    )
 
-                    # compute the hash -> check if it already is in the list
-                    seq_hash = hash(str(protein_seq))
-                    nearest_idx = bisect.bisect_left(
-                        KeyWrapper(local_result_sequences, key=lambda x: x["hash"]),
-                        seq_hash,
+                    # check if the sequence is already stored
+                    local_result_sequences.add(
+                        protein_seq,
+                        {"haplotypes": haplotypeID, "rfs": str(rf)},
+                        {"start": protein_start},
                     )
-                    if (
-                        len(local_result_sequences) > nearest_idx
-                        and local_result_sequences[nearest_idx]["hash"] == seq_hash
-                    ):
-                        local_result_sequences[nearest_idx]["haplotypes"].append(
-                            haplotypeID
-                        )
-                        local_result_sequences[nearest_idx]["rfs"].append(str(rf))
-                    else:
-                        local_result_sequences.insert(
-                            nearest_idx,
-                            {
-                                "hash": seq_hash,
-                                "haplotypes": [haplotypeID],
-                                "sequence": protein_seq,
-                                "start": protein_start,
-                                "rfs": [str(rf)],
-                            },
-                        )
 
                 # store result
+                all_vcf_IDs = [transcript_variants[var].ID for var in all_variants]
                 haplo_hash = hash(";".join(all_vcf_IDs))
 
                 local_result_data[haplo_hash] = [
-                    row["TranscriptID"],
+                    row.TranscriptID,
                     chromosome,
                     current_transcript["biotype"],
                     haplotypeID,
                     ";".join(
                         all_vcf_IDs
                     ),  # could be sorted in reverse order if on reverse strand
-                    ";".join(all_changes),
-                    ";".join(all_AFs),
+                    ";".join(
+                        [format_change(transcript_variants[var]) for var in all_variants]
+                    ),
+                    ";".join([transcript_variants[var].AF for var in all_variants]),
                     ";".join(cDNA_changes),
                     ";".join(all_protein_changes),
                     ";".join(prot_var_types),
@@ -693,10 +654,10 @@ def process_haplotypes(
                     current_transcript["start_codon"] is None,
                     start_lost,
                     spl_junctions_affected_str,
-                    row["Count"],
-                    row["Frequency"],
-                    row["Frequency_population"],
-                    row["Frequency_superpopulation"],
+                    row.Count,
+                    row.Frequency,
+                    row.Frequency_population,
+                    row.Frequency_superpopulation,
                 ]
 
         # filter haplotypes by frequency
@@ -718,7 +679,7 @@ def process_haplotypes(
         included_haplotype_ids = [haplotype[3] for haplotype in result_table]
 
         # remove haplotypes below threshold from the FASTA header data
-        for seq in local_result_sequences:
+        for seq in local_result_sequences.values():
             haplotypes_filter = [
                 (hap in included_haplotype_ids) for hap in seq["haplotypes"]
             ]  # list of booleans - are these haplotypes in the list after thresholding?
@@ -735,32 +696,72 @@ def process_haplotypes(
 
         # remove sequences where all matching haplotypes were filtered out
         local_result_sequences = [
-            seq for seq in local_result_sequences if len(seq["haplotypes"]) > 0
+            seq
+            for seq in local_result_sequences.values()
+            if len(seq["haplotypes"]) > 0
+        ]
+
+        # store the mutated cDNA sequences of this transcript
+        if export_cdna:
+            cdna_export.write(mutated_cdnas)
+
+        # store the newly computed variant effects
+        if consequence_cache is not None:
+            consequence_cache.store(
+                transcript_feature.id,
+                len(current_transcript["fasta_element"]["sequence"]),
+                new_effects,
+            )
+
+        return [result_table, local_result_sequences]
+
+    # partition the haplotype table by transcript once -> every task gets only the rows of its transcript
+    haplotype_rows = [
+        HaplotypeRow._make(row)
+        for row in zip(
+            genes_haplo_df.index,
+            *[genes_haplo_df[column] for column in HaplotypeRow._fields[1:]],
+        )
+    ]
+    transcript_row_indices = genes_haplo_df.groupby("TranscriptID", sort=False).indices
+    tasks = []
+    costs = []
+    for transcript_feature in all_transcripts:
+        transcript_rows = [
+            haplotype_rows[i]
+            for i in transcript_row_indices.get(transcript_feature.id, [])
         ]
+        transcript_variants = {
+            row_idx: variants[row_idx]
+            for row in transcript_rows
+            for row_idx in row.Variants
+        }
+        tasks.append((transcript_feature, transcript_rows, transcript_variants))
 
-        return [result_table, local_result_sequences, dico_mutated_cDNA]
+        # estimated cost of the task: variants x haplotypes x cDNA length
+        costs.append(
+            max(len(transcript_variants), 1)
+            * len(transcript_rows)
+            * transcript_feature.length
+        )
 
-    # aggregated_results = list(map(process_transcript_haplotypes, all_transcripts))
+    # aggregated_results = list(map(process_transcript_haplotypes, tasks))
     with Pool(threads) as p:
-        aggregated_results = p.map(process_transcript_haplotypes, all_transcripts)
+        aggregated_results = map_by_cost(
+            p, process_transcript_haplotypes, tasks, costs
+        )
 
         result_data = []
         result_sequences = []
-        result_cDNA = {}
 
         for result_point in aggregated_results:
-            if len(result_point) == 3:
+            if len(result_point) == 2:
                 result_data = result_data + list(result_point[0])
                 result_sequences = result_sequences + result_point[1]
-                result_cDNA.update(result_point[2])
 
-        df_cDNA = pd.DataFrame.from_dict(
-            {"ascession": list(result_cDNA.keys()), "cDNA": list(result_cDNA.values())}
-        )
-        cdna_folder = folder_res + "/cDNA_res/"
-        if not os.path.exists(cdna_folder):
-            os.mkdir(cdna_folder)
-        df_cDNA.to_csv(cdna_folder + chromosome + ".csv")
+        if export_cdna:
+            cdna_export.finish()
+
         result_df = pd.DataFrame(columns=result_columns, data=result_data)
 
         return [result_df, result_sequences]
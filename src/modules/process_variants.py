@@ -1,10 +1,13 @@
 from datetime import datetime
 from numpy import ceil, floor
 import pandas as pd
-import bisect
+from multiprocessing import Pool
 from Bio.Seq import Seq
-from modules.coordinates_toolbox import get_rna_position, get_rna_position_simple, check_start_change, get_affected_codons
-from modules.common import KeyWrapper, check_vcf_df
+from modules.coordinates_toolbox import CoordinateMapper, check_start_change, get_affected_codons
+from modules.cdna_editor import apply_changes
+from modules.common import SequenceRegistry, check_vcf_df
+from modules.consequence_cache import get_variant_effect
+from modules.translation import translate_frames, translate_mutated
 
 result_columns = [  
     'transcriptID', 
@@ -45,46 +48,49 @@ def check_start_gain(mutated_cdna, rna_location, alt_len):
 
     return -1
 
-def process_store_variants(all_transcripts, tmp_dir, log_file, all_cdnas, annotations_db, chromosome, fasta_tag, accession_prefix, force_rf, output_file, output_fasta):
-    current_transcript = None
-    result_data = []
-    protein_sequence_list = []      # way to avoid duplicate sequences -> access sequences by hash, aggregate variant IDs that correspond
+def process_store_variants(all_transcripts, variant_store, log_file, all_cdnas, chromosome, fasta_tag, accession_prefix, force_rf, output_file, output_fasta, threads=1, consequence_cache=None):
+    protein_sequence_list = SequenceRegistry()      # way to avoid duplicate sequences -> access sequences by digest, aggregate variant IDs that correspond
 
-    for transcript in all_transcripts:
+    global process_transcript_variants
+
+    # process all the variants of a single transcript
+    # returns the rows of the result table, protein sequences as (sequence, variant ID, reading frame, start) and messages for the log file
+    def process_transcript_variants(transcript):
+        result_data = []
+        protein_sequences = []
+        log_messages = []
         transcript_id = transcript.id
         
-        # load the according VCF file to Pandas
-        vcf_df =  check_vcf_df(pd.read_csv(tmp_dir + '/' + transcript_id + '.tsv', sep='\t'))
+        # get the VCF entries of this transcript from the store
+        vcf_df =  check_vcf_df(variant_store.transcript_dataframe(transcript_id))
 
         if (len(vcf_df) == 0):
-            continue
+            return result_data, protein_sequences, log_messages
 
         # Check if we have the cDNA sequence in the fasta
         if transcript_id not in all_cdnas:
-            log_file.write('Transcript ' + transcript_id + ' does not have a reference cDNA sequence - skipping.\n')
-            continue
+            log_messages.append('Transcript ' + transcript_id + ' does not have a reference cDNA sequence - skipping.\n')
+            return result_data, protein_sequences, log_messages
 
         # store the annotation features of this transcript
-        if (current_transcript is None or current_transcript['ID'] != transcript_id):
-            transcript_feature = annotations_db[transcript_id]
-            exons = [ exon for exon in annotations_db.children(transcript_feature, featuretype='exon', order_by='start') ]
-            start_codons = [ sc for sc in annotations_db.children(transcript_feature, featuretype='start_codon', order_by='start') ]    # there should be only one, but just in case...
-            stop_codons = [ sc for sc in annotations_db.children(transcript_feature, featuretype='stop_codon', order_by='start') ] 
-            biotype = transcript_feature['transcript_biotype'][0]
-
-            # start and stop codon positions are not given for some transcripts
-            start_codon = None
-            stop_codon = None
-
-            if len(start_codons) > 0:
-                start_codon = start_codons[0]
-            if len(stop_codons) > 0:
-                stop_codon = stop_codons[0]
-
-            current_transcript = { 'ID': transcript_id, 'feature': transcript_feature, 'exons': exons, 'start_codon': start_codon, 'stop_codon': stop_codon, 'fasta_element': all_cdnas[transcript_id.split('.')[0]], 'biotype': biotype }
+        transcript_feature = transcript
+        mapper = CoordinateMapper.from_transcript(transcript_feature)
+        biotype = transcript_feature.biotype
+
+        # start and stop codon positions are not given for some transcripts
+        start_codon = transcript_feature.start_codon
+        stop_codon = transcript_feature.stop_codon
+
+        # positions of the start and stop codon in the cDNA (-1 if not annotated or not in an exon), mapped in a single call
+        codon_locations = mapper.rna_positions([ codon.start if (codon is not None) else -1 for codon in (start_codon, stop_codon) ]).tolist()
+
+        current_transcript = { 'ID': transcript_id, 'feature': transcript_feature, 'mapper': mapper, 'start_codon': start_codon, 'stop_codon': stop_codon, 'codon_locations': codon_locations, 'fasta_element': all_cdnas[transcript_id.split('.')[0]], 'biotype': biotype }
         
         cdna_sequence = current_transcript['fasta_element']['sequence']  # reference cDNA        
+        reference_frames = translate_frames(cdna_sequence)                # translation of the reference cDNA in all three reading frames, reused for the unchanged parts of the variants
         reverse_strand = current_transcript['feature'].strand == '-'     # boolean - are we on a reverse strand?
+        cached_effects = consequence_cache.transcript_effects(transcript_id, len(cdna_sequence)) if (consequence_cache is not None) else {}    # effects of variants computed before (by ProHap or a previous run), accessed by (POS, REF, ALT)
+        new_effects = {}            # effects computed here, to be added to the cache
 
         reading_frame = -1          # reading frame (0, 1 or 2), if known (inferred from the start codon position), -1 if unknown
         start_loc = 0               # location of the first nucleotide of the start codon with respect to the transcript start (0 if unknown)
@@ -92,7 +98,9 @@ def process_store_variants(all_transcripts, tmp_dir, log_file, all_cdnas, annota
 
         # Get the reading frame from the length between the start of the transcript and the start codon
         if (current_transcript['start_codon'] is not None):
-            start_loc = get_rna_position_simple(transcript_id, current_transcript['start_codon'].start, current_transcript['exons'])
+            start_loc = current_transcript['codon_locations'][0]
+            if (start_loc == -1):
+                raise Exception(transcript_id + ': DNA location ' + str(current_transcript['start_codon'].start) + ' is not in an exon.')
             if (reverse_strand):
                 start_loc = len(cdna_sequence) - start_loc - 3  
 
@@ -101,7 +109,9 @@ def process_store_variants(all_transcripts, tmp_dir, log_file, all_cdnas, annota
 
         # Alternatively, use the stop codon in the same way, assume start at codon 0
         elif ((current_transcript['stop_codon'] is not None) and force_rf):
-            stop_loc = get_rna_position_simple(transcript_id, current_transcript['stop_codon'].start, current_transcript['exons'])
+            stop_loc = current_transcript['codon_locations'][1]
+            if (stop_loc == -1):
+                raise Exception(transcript_id + ': DNA location ' + str(current_transcript['stop_codon'].start) + ' is not in an exon.')
             if (reverse_strand):
                 stop_loc = len(cdna_sequence) - stop_loc - 3  
 
@@ -111,18 +121,6 @@ def process_store_variants(all_transcripts, tmp_dir, log_file, all_cdnas, annota
         for index, vcf_row in vcf_df.iterrows():
             dna_location = int(vcf_row['POS'])
 
-            ref_allele = ''
-            if vcf_row['REF'] == '-':
-                ref_allele = Seq('')
-            else:
-                ref_allele = Seq(vcf_row['REF'])
-
-            alt_allele = ''
-            if vcf_row['ALT'] == '-':
-                alt_allele = Seq('')
-            else:
-                alt_allele = Seq(vcf_row['ALT'])
-
             var_ID = accession_prefix + '_' + transcript_id + '_' + hex(index)[2:]
 
             DNA_change = str(vcf_row['POS']) + ':' + vcf_row['REF'] + '>' + vcf_row['ALT']
@@ -130,46 +128,46 @@ def process_store_variants(all_transcripts, tmp_dir, log_file, all_cdnas, annota
             cDNA_change = ''                        # change in the cDNA
             protein_change = ''                     # change in the protein sequence
             spl_junction_affected = '-'             # splicing junction where a mutation takes place (identified by order, where 1 is the junction between the 1. and 2. exon), '-' if none affected
-            mutated_cdna = Seq(cdna_sequence)       # cDNA sequence to mutate
             protein_start_variant = protein_start   # length of the UTR prefix in this protein variant (can differ if indel in 5' UTR)
             reading_frame_variant = reading_frame   # reading frame in this protein variant   
             start_lost = False                      # have we lost the canonical start codon?
 
-            # compute the location in the RNA sequence
+            # compute the location in the RNA sequence, unless found in the cache
             # do any of the allele sequences intersect a splicing site? => truncate if so
-            rna_location, ref_allele, ref_len, alt_allele, alt_len, spl_junction_affected = get_rna_position(transcript_id, dna_location, ref_allele, alt_allele, current_transcript['exons'])
+            # if we are on a reverse strand, the reference and alternative sequence are complemented to match the cDNA, the position is counted from the end
+            variant_key = (dna_location, vcf_row['REF'], vcf_row['ALT'])
+            if variant_key not in cached_effects:
+                cached_effects[variant_key] = get_variant_effect(vcf_row, current_transcript['mapper'], len(cdna_sequence), reverse_strand)
+                new_effects[variant_key] = cached_effects[variant_key]
 
-            # if we are on a reverse strand, we need to complement the reference and alternative sequence to match the cDNA
-            # we also need to count the position from the end
-            if reverse_strand:
-                ref_allele = ref_allele.reverse_complement()
-                alt_allele = alt_allele.reverse_complement()
-                rna_location = len(cdna_sequence) - rna_location - ref_len
+            rna_location, ref_allele, ref_len, alt_allele, alt_len, spl_junction_affected, _, _ = cached_effects[variant_key]
+            ref_allele = Seq(ref_allele)
+            alt_allele = Seq(alt_allele)
 
             # check if what we expected to find is in fact in the cDNA
-            if (str(ref_allele) != mutated_cdna[rna_location:rna_location+ref_len]):
+            if (str(ref_allele) != cdna_sequence[rna_location:rna_location+ref_len]):
 
                 # if mismatched, check if shifting one base to the right will help
                 dna_location += 1
-                rna_location, ref_allele, ref_len, alt_allele, alt_len, spl_junction_affected = get_rna_position(transcript_id, dna_location, ref_allele, alt_allele, current_transcript['exons'])
+                rna_location, ref_allele, ref_len, alt_allele, alt_len, spl_junction_affected = current_transcript['mapper'].rna_position_allele(dna_location, ref_allele, alt_allele)
                 if reverse_strand:
                     rna_location = len(cdna_sequence) - rna_location - ref_len
 
-                if (str(ref_allele) != mutated_cdna[rna_location:rna_location+ref_len]):
+                if (str(ref_allele) != cdna_sequence[rna_location:rna_location+ref_len]):
 
                     # if still mismatched, try one base to the left                    
                     dna_location -= 2
-                    rna_location, ref_allele, ref_len, alt_allele, alt_len, spl_junction_affected = get_rna_position(transcript_id, dna_location, ref_allele, alt_allele, current_transcript['exons'])
+                    rna_location, ref_allele, ref_len, alt_allele, alt_len, spl_junction_affected = current_transcript['mapper'].rna_position_allele(dna_location, ref_allele, alt_allele)
                     if reverse_strand:
                         rna_location = len(cdna_sequence) - rna_location - ref_len
 
-                    if (str(ref_allele) != mutated_cdna[rna_location:rna_location+ref_len]):
+                    if (str(ref_allele) != cdna_sequence[rna_location:rna_location+ref_len]):
                         print('Ref allele not matching the cDNA sequence, skipping!')
-                        log_file.write('[' + datetime.now().strftime('%X %x') + '] Ref allele not matching the cDNA sequence: ' + transcript_id + ' (reverse strand: ' + str(reverse_strand) + ') ID:' + vcf_row['ID'] + ' expected: ' + str(ref_allele) + ' found in cDNA: ' +  str(mutated_cdna[rna_location-10:rna_location]) + ' ' + str(mutated_cdna[rna_location:rna_location+ref_len]) + ' ' + str(mutated_cdna[rna_location+ref_len:rna_location+ref_len+10]) + '\n')
+                        log_messages.append('[' + datetime.now().strftime('%X %x') + '] Ref allele not matching the cDNA sequence: ' + transcript_id + ' (reverse strand: ' + str(reverse_strand) + ') ID:' + vcf_row['ID'] + ' expected: ' + str(ref_allele) + ' found in cDNA: ' +  cdna_sequence[rna_location-10:rna_location] + ' ' + cdna_sequence[rna_location:rna_location+ref_len] + ' ' + cdna_sequence[rna_location+ref_len:rna_location+ref_len+10] + '\n')
                         continue
             
             # apply the change to the cDNA
-            mutated_cdna = mutated_cdna[:rna_location] + alt_allele + mutated_cdna[rna_location+ref_len:]
+            mutated_cdna, mutated_locations, _ = apply_changes(cdna_sequence, [rna_location], [str(ref_allele)], [str(alt_allele)])
 
             cDNA_change = str(rna_location) + ':' + str(ref_allele) + '>' + str(alt_allele)
 
@@ -228,42 +226,49 @@ def process_store_variants(all_transcripts, tmp_dir, log_file, all_cdnas, annota
 
             # check the reading frame, if possible, and translate
             if (reading_frame_variant > -1):
-                protein_seq = mutated_cdna[reading_frame_variant:].transcribe().translate()
-
-                # compute the hash -> check if it already is in the list
-                seq_hash = hash(str(protein_seq))
-                nearest_idx = bisect.bisect_left(KeyWrapper(protein_sequence_list, key=lambda x: x['hash']), seq_hash)
-                if (len(protein_sequence_list) > nearest_idx and protein_sequence_list[nearest_idx]['hash'] == seq_hash):
-                    protein_sequence_list[nearest_idx]['variants'].append(var_ID)
-                    protein_sequence_list[nearest_idx]['rfs'].append(str(reading_frame_variant))
-                else:
-                    protein_sequence_list.insert(nearest_idx, {'hash': seq_hash, 'variants': [var_ID], 'sequence': protein_seq, 'start': protein_start_variant, 'rfs': [str(reading_frame_variant)]})
+                protein_seq = translate_mutated(mutated_cdna, reading_frame_variant, reference_frames, len(cdna_sequence), [rna_location], [str(ref_allele)], mutated_locations, [str(alt_allele)])
+
+                protein_sequences.append((protein_seq, var_ID, str(reading_frame_variant), protein_start_variant))
 
 
             # unknown reading frame -> translate in all 3 reading frames
             else:
                 for rf in range(0,3):
-                    protein_seq = mutated_cdna[rf:].transcribe().translate()
-
-                    # compute the hash -> check if it already is in the list
-                    seq_hash = hash(str(protein_seq))
-                    nearest_idx = bisect.bisect_left(KeyWrapper(protein_sequence_list, key=lambda x: x['hash']), seq_hash)
-                    if (len(protein_sequence_list) > nearest_idx and protein_sequence_list[nearest_idx]['hash'] == seq_hash):
-                        protein_sequence_list[nearest_idx]['variants'].append(var_ID)
-                        protein_sequence_list[nearest_idx]['rfs'].append(str(rf))
-                    else:
-                        protein_sequence_list.insert(nearest_idx, {'hash': seq_hash, 'variants': [var_ID], 'sequence': protein_seq, 'start': protein_start_variant, 'rfs': [str(rf)]})
-
-    # write the result table
+                    protein_seq = translate_mutated(mutated_cdna, rf, reference_frames, len(cdna_sequence), [rna_location], [str(ref_allele)], mutated_locations, [str(alt_allele)])
+
+                    protein_sequences.append((protein_seq, var_ID, str(rf), protein_start_variant))
+
+        # store the newly computed variant effects
+        if (consequence_cache is not None):
+            consequence_cache.store(transcript_id, len(cdna_sequence), new_effects)
+
+        return result_data, protein_sequences, log_messages
+
+    # write the result table, transcript by transcript as the results arrive (in the order of the transcripts)
     print ('Storing the result metadata:', output_file)
-    result_df = pd.DataFrame(columns=result_columns, data=result_data)
-    result_df.to_csv(output_file, sep='\t', header=True, index=False)
+    outfile = open(output_file, 'w')
+    outfile.write('\t'.join(result_columns) + '\n')
+
+    with Pool(threads) as p:
+        for result_data, protein_sequences, log_messages in p.imap(process_transcript_variants, all_transcripts):
+            log_file.write(''.join(log_messages))
+
+            if (len(result_data) > 0):
+                result_df = pd.DataFrame(columns=result_columns, data=result_data)
+                result_df['splice_site_affected'] = result_df['splice_site_affected'].astype(float)   # same format in every part of the table (None -> empty, number -> float)
+                result_df.to_csv(outfile, sep='\t', header=False, index=False)
+
+            # check if the sequence is already stored -> add the variant ID to the existing entry if so
+            for protein_seq, var_ID, rf, protein_start_variant in protein_sequences:
+                protein_sequence_list.add(protein_seq, {'variants': var_ID, 'rfs': rf}, {'start': protein_start_variant})
+
+    outfile.close()
 
     # write the unique protein sequences into the fasta file
     output_fasta_file = open(output_fasta, 'w')
     print ('Writing FASTA file:', output_fasta)
 
-    for i,seq in enumerate(protein_sequence_list):
+    for i,seq in enumerate(protein_sequence_list.values()):
         accession = accession_prefix + 'chr' + chromosome + '_' + hex(i)[2:]
         description = 'matching_proteins:' + ';'.join(seq['variants']) + ' start:' + str(seq['start']) + ' reading_frame:' + ';'.join(seq['rfs'])
 
@@ -0,0 +1,171 @@
+import numpy as np
+from Bio.Seq import Seq
+
+NUCLEOTIDES = "ACGT"
+OTHER_NUCLEOTIDE = len(NUCLEOTIDES)  # code of any other character (N, ambiguous bases, lowercase, ...)
+CODE_BASE = OTHER_NUCLEOTIDE + 1
+
+# code of every byte value: A, C, G, T -> 0 - 3, anything else -> 4
+NUCLEOTIDE_CODES = np.full(256, OTHER_NUCLEOTIDE, dtype=np.int16)
+for code, nucleotide in enumerate(NUCLEOTIDES):
+    NUCLEOTIDE_CODES[ord(nucleotide)] = code
+
+# residue of every codon as index by the codes of its nucleotides: code1 * 25 + code2 * 5 + code3
+# built from the Biopython translation (standard table), so that the results are identical
+# codons containing any other character are marked with 0 and translated separately
+CODON_TABLE = np.zeros(CODE_BASE**3, dtype=np.uint8)
+for i, first in enumerate(NUCLEOTIDES):
+    for j, second in enumerate(NUCLEOTIDES):
+        for k, third in enumerate(NUCLEOTIDES):
+            CODON_TABLE[i * CODE_BASE**2 + j * CODE_BASE + k] = ord(
+                str(Seq(first + second + third).transcribe().translate())
+            )
+
+# the same table as a dict accessed by the codon, faster for short sequences (e.g., a few affected codons)
+CODONS = {
+    first + second + third: chr(CODON_TABLE[i * CODE_BASE**2 + j * CODE_BASE + k])
+    for i, first in enumerate(NUCLEOTIDES)
+    for j, second in enumerate(NUCLEOTIDES)
+    for k, third in enumerate(NUCLEOTIDES)
+}
+
+# sequences up to this length (in codons) are translated codon by codon using the dict
+SHORT_SEQUENCE_CODONS = 16
+
+# translations of the codons with ambiguous characters, filled in when first seen
+other_codons = {}
+
+
+# Translates a single codon that is not in the table, in the same way as Bio.Seq (raises TranslationError if invalid)
+def translate_other_codon(codon):
+    if codon not in other_codons:
+        other_codons[codon] = str(Seq(codon).transcribe().translate())
+    return other_codons[codon]
+
+
+# Translates codes of the nucleotides (array as returned by encode_sequence) in the reading frame 0, incomplete codon at the end is ignored
+def translate_codes(sequence_bytes, codes):
+    codon_count = len(codes) // 3
+    if codon_count == 0:
+        return ""
+
+    codons = codes[: codon_count * 3].reshape(-1, 3)
+    codon_idx = codons[:, 0] * CODE_BASE**2 + codons[:, 1] * CODE_BASE + codons[:, 2]
+    residues = CODON_TABLE[codon_idx]
+
+    # codons with ambiguous characters are translated one by one
+    for codon_pos in np.flatnonzero(residues == 0).tolist():
+        codon = sequence_bytes[codon_pos * 3 : codon_pos * 3 + 3].decode()
+        residues[codon_pos] = ord(translate_other_codon(codon))
+
+    return residues.tobytes().decode()
+
+
+# codes of the nucleotides of a DNA sequence (string)
+def encode_sequence(sequence):
+    sequence_bytes = sequence.encode()
+    return sequence_bytes, NUCLEOTIDE_CODES[np.frombuffer(sequence_bytes, dtype=np.uint8)]
+
+
+# Translates a DNA (cDNA) sequence into protein using the standard codon table, same as str(Seq(sequence).transcribe().translate()),
+# a trailing incomplete codon is ignored
+def translate(sequence):
+    sequence = str(sequence)
+    if len(sequence) <= SHORT_SEQUENCE_CODONS * 3:
+        return "".join(
+            [
+                CODONS.get(sequence[i : i + 3]) or translate_other_codon(sequence[i : i + 3])
+                for i in range(0, len(sequence) - 2, 3)
+            ]
+        )
+
+    sequence_bytes, codes = encode_sequence(sequence)
+    return translate_codes(sequence_bytes, codes)
+
+
+# Translates a DNA (cDNA) sequence in all three reading frames (starting at the 1st, 2nd and 3rd nucleotide)
+# returns: list of three protein sequences
+def translate_frames(sequence):
+    sequence_bytes, codes = encode_sequence(str(sequence))
+    return [translate_codes(sequence_bytes[rf:], codes[rf:]) for rf in range(3)]
+
+
+# Translates a mutated sequence in the given reading frame, reusing the translation of the reference sequence:
+# codons lying between the changes are the same as codons of the reference (in a possibly different reading frame, if preceded by indels),
+# only the codons overlapping a change are translated -> the work is proportional to the number of changes rather than the sequence length.
+# Same result as translate(mutated[reading_frame:]).
+# input:
+# mutated: the mutated sequence, as returned by apply_changes
+# reading_frame: reading frame of the mutated sequence (0, 1 or 2)
+# reference_frames: translation of the reference sequence in the three reading frames (as returned by translate_frames)
+# reference_length: length of the reference sequence
+# rna_locations, ref_alleles: location of every change in the reference and the reference allele
+# mutated_locations, alt_alleles: location of every change in the mutated sequence (as returned by apply_changes) and the alternative allele
+def translate_mutated(
+    mutated,
+    reading_frame,
+    reference_frames,
+    reference_length,
+    rna_locations,
+    ref_alleles,
+    mutated_locations,
+    alt_alleles,
+):
+    # the changes must be sorted and within the reference, otherwise translate the whole sequence
+    if (len(rna_locations) > 0) and (
+        (rna_locations[0] < 0)
+        or (rna_locations[-1] + len(ref_alleles[-1]) > reference_length)
+        or not all(
+            rna_locations[i] + len(ref_alleles[i]) <= rna_locations[i + 1]
+            for i in range(len(rna_locations) - 1)
+        )
+    ):
+        return translate(mutated[reading_frame:])
+
+    # segments of the mutated sequence unaffected by the changes: (start, end, shift with respect to the reference)
+    segments = []
+    segment_start = 0
+    sequence_length_diff = 0
+    for ch_idx, mutated_location in enumerate(mutated_locations):
+        segments.append((segment_start, mutated_location, sequence_length_diff))
+        segment_start = mutated_location + len(alt_alleles[ch_idx])
+        sequence_length_diff += len(alt_alleles[ch_idx]) - len(ref_alleles[ch_idx])
+    segments.append((segment_start, len(mutated), sequence_length_diff))
+
+    codon_count = max(len(mutated) - reading_frame, 0) // 3
+    protein = []
+    next_codon = 0  # index of the first codon not yet translated
+
+    for segment_start, segment_end, shift in segments:
+        # codons lying fully within the segment
+        first_codon = max(-((reading_frame - segment_start) // 3), next_codon)
+        last_codon = min((segment_end - reading_frame) // 3, codon_count)
+        if first_codon >= last_codon:
+            continue
+
+        # codons overlapping the preceding change(s)
+        if next_codon < first_codon:
+            protein.append(
+                translate(
+                    mutated[reading_frame + next_codon * 3 : reading_frame + first_codon * 3]
+                )
+            )
+
+        # the same codons in the reference
+        reference_rf = (reading_frame - shift) % 3
+        reference_codon = (reading_frame + first_codon * 3 - shift - reference_rf) // 3
+        protein.append(
+            reference_frames[reference_rf][
+                reference_codon : reference_codon + last_codon - first_codon
+            ]
+        )
+        next_codon = last_codon
+
+    if next_codon < codon_count:
+        protein.append(
+            translate(
+                mutated[reading_frame + next_codon * 3 : reading_frame + codon_count * 3]
+            )
+        )
+
+    return "".join(protein)
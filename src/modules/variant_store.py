@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from modules.vcf_record import VCFTokenizer
+from modules.genotypes import decode_genotypes
+
+PHASED = ord("|")
+
+# a single VCF entry (with one ALT allele) as used in haplotypes: position, alleles, allele frequency (string, '-1' if not given) and ID
+Variant = namedtuple("Variant", ["POS", "REF", "ALT", "AF", "ID"])
+
+
+# change in the format POS:REF>ALT, as written in the result tables
+def format_change(variant):
+    return str(variant.POS) + ":" + variant.REF + ">" + variant.ALT
+
+
+# In-memory store of VCF entries assigned to transcripts.
+# Every VCF entry is stored only once, even if it belongs to multiple transcripts. Transcripts keep a list of row indices into the store.
+# The fixed columns are stored column-wise, genotypes of all the entries are kept in a dense uint8 matrix of shape (variants, samples, 2):
+# value 1 means that the alternative allele is present on the given copy of the chromosome.
+# The store can be saved to disk and loaded again as a memory-mapped matrix, shared by all worker processes without copying.
+class VariantStore:
+    # columns: column names from the VCF header (without the leading '#'), empty if the VCF has no entries
+    def __init__(self, columns):
+        self.columns = columns
+        self.tokenizer = VCFTokenizer(columns)
+        self.fixed_columns = self.tokenizer.fixed_columns
+        self.samples = self.tokenizer.samples
+        self.sample_index = {sample: i for i, sample in enumerate(self.samples)}
+
+        self.fixed_data = {colname: [] for colname in self.fixed_columns}
+        self.unphased = {}  # row index -> indices of samples with unphased genotypes (rare, kept for the sanity check)
+
+        self.matrix = np.zeros((0, len(self.samples), 2), dtype=np.uint8)
+        self.pending_rows = []  # genotype rows added since the matrix was last assembled
+
+        self.transcript_rows = {}  # transcript ID -> list of row indices, in the order of the VCF
+
+    def __len__(self):
+        return len(self.fixed_data["POS"]) if "POS" in self.fixed_data else 0
+
+    # store a VCFRecord, return the index of the row
+    def add_record(self, record):
+        for colname, value in zip(self.fixed_columns, record.fields):
+            self.fixed_data[colname].append(value)
+        self.fixed_data["POS"][-1] = int(self.fixed_data["POS"][-1])
+        row_idx = len(self) - 1
+
+        # VCF without samples (e.g., ProVar input) -> no genotypes to store, the matrix has 0 samples
+        if len(self.samples) == 0:
+            return row_idx
+
+        # only phased genotypes count: alleles of unphased genotypes are ignored
+        alleles, separators = decode_genotypes(record.genotype_block)
+        phased = separators == PHASED
+        self.pending_rows.append(((alleles == 1) & phased[:, None]).astype(np.uint8))
+
+        if not phased.all():
+            self.unphased[row_idx] = set(np.flatnonzero(~phased).tolist())
+
+        return row_idx
+
+    def add_transcript(self, transcript_id):
+        if transcript_id not in self.transcript_rows:
+            self.transcript_rows[transcript_id] = []
+
+    def assign(self, transcript_id, row_idx):
+        self.transcript_rows[transcript_id].append(row_idx)
+
+    def transcript_records(self, transcript_id):
+        return self.transcript_rows.get(transcript_id, [])
+
+    # returns the fixed columns of a row as a dict, accessed by the column name
+    def record(self, row_idx):
+        return {colname: self.fixed_data[colname][row_idx] for colname in self.fixed_columns}
+
+    # returns a row as a Variant, the allele frequency is read from the INFO column
+    def variant(self, row_idx):
+        info = self.fixed_data["INFO"][row_idx]
+        if "AF" in info:
+            AF = info.split("AF=")[1].split(";")[0].split(maxsplit=1)[0]
+        else:
+            AF = "-1"
+
+        return Variant(
+            self.fixed_data["POS"][row_idx],
+            self.fixed_data["REF"][row_idx],
+            self.fixed_data["ALT"][row_idx],
+            AF,
+            str(self.fixed_data["ID"][row_idx]),
+        )
+
+    # the genotype matrix of all the rows, shape (variants, samples, 2)
+    @property
+    def genotype_matrix(self):
+        if len(self.samples) == 0:
+            if len(self.matrix) != len(self):
+                self.matrix = np.zeros((len(self), 0, 2), dtype=np.uint8)
+            return self.matrix
+
+        if len(self.pending_rows) > 0:
+            self.matrix = np.concatenate(
+                (
+                    self.matrix,
+                    np.stack(self.pending_rows).reshape(-1, len(self.samples), 2),
+                )
+            )
+            self.pending_rows = []
+        return self.matrix
+
+    # returns the genotypes of a row, shape (samples, 2), in the order of self.samples
+    def genotypes(self, row_idx):
+        return self.genotype_matrix[row_idx]
+
+    # returns a dataframe of fixed columns of all the rows assigned to this transcript
+    def transcript_dataframe(self, transcript_id):
+        rows = self.transcript_records(transcript_id)
+        return pd.DataFrame(
+            {
+                colname: [self.fixed_data[colname][row_idx] for row_idx in rows]
+                for colname in self.fixed_columns
+            },
+            columns=self.fixed_columns,
+        )
+
+    # Store the content on disk, all files start with the given prefix:
+    # prefix.npy: genotype matrix, prefix_columns.txt: VCF column names, prefix_variants.tsv: fixed columns of the rows,
+    # prefix_transcripts.tsv: row indices assigned to every transcript
+    def save(self, prefix):
+        with open(prefix + "_columns.txt", "w") as columns_file:
+            columns_file.write("".join([colname + "\n" for colname in self.columns]))
+
+        np.save(prefix + ".npy", self.genotype_matrix)
+
+        variants_df = pd.DataFrame(self.fixed_data, columns=self.fixed_columns)
+        variants_df["Unphased"] = [
+            ";".join([str(i) for i in sorted(self.unphased.get(row_idx, []))])
+            for row_idx in range(len(self))
+        ]
+        variants_df.to_csv(prefix + "_variants.tsv", sep="\t", index=False)
+
+        transcripts_df = pd.DataFrame(
+            {
+                "TranscriptID": list(self.transcript_rows.keys()),
+                "Rows": [
+                    ";".join([str(row_idx) for row_idx in rows])
+                    for rows in self.transcript_rows.values()
+                ],
+            },
+            columns=["TranscriptID", "Rows"],
+        )
+        transcripts_df.to_csv(prefix + "_transcripts.tsv", sep="\t", index=False)
+
+    # Load a store saved by VariantStore.save, the genotype matrix is memory-mapped (read-only) unless mmap is set to False
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        with open(prefix + "_columns.txt", "r") as columns_file:
+            columns = [line.rstrip("\r\n") for line in columns_file if line.strip() != ""]
+
+        store = cls(columns)
+        if len(columns) == 0:
+            return store
+
+        store.matrix = np.load(prefix + ".npy", mmap_mode=("r" if mmap else None))
+
+        variants_df = pd.read_csv(
+            prefix + "_variants.tsv", sep="\t", dtype=str, keep_default_na=False
+        )
+        for colname in store.fixed_columns:
+            store.fixed_data[colname] = variants_df[colname].tolist()
+        store.fixed_data["POS"] = [int(pos) for pos in store.fixed_data["POS"]]
+
+        for row_idx, unphased in enumerate(variants_df["Unphased"]):
+            if unphased != "":
+                store.unphased[row_idx] = set(int(i) for i in unphased.split(";"))
+
+        transcripts_df = pd.read_csv(
+            prefix + "_transcripts.tsv", sep="\t", dtype=str, keep_default_na=False
+        )
+        for transcript_id, rows in zip(
+            transcripts_df["TranscriptID"], transcripts_df["Rows"]
+        ):
+            store.transcript_rows[transcript_id] = (
+                [int(row_idx) for row_idx in rows.split(";")] if rows != "" else []
+            )
+
+        return store
@@ -1,13 +1,18 @@
 import bisect
 from modules.common import KeyWrapper
-from io import StringIO
-import pandas as pd
+from modules.exon_index import ExonIndex
+from modules.variant_store import VariantStore
+from modules.genotypes import split_genotypes
+import pysam
 import re
 
-global_list_of_lines = []
+global_list_of_records = []
 
 
-def check_vcf_line_validity(line, min_af, REF, ALT):
+def check_vcf_line_validity(record, min_af):
+    REF = record.ref
+    ALT = record.alt
+
     # check the allele frequency
     # AF_pass = min_af <= 0
     # if ";AF=" in line:
@@ -34,168 +39,152 @@ def check_vcf_line_validity(line, min_af, REF, ALT):
 
 
 def add_variants_to_transcripts(
-    vcf_file_line,
+    vcf_record,
     vcf_file,
     vcf_linecount,
     transcript_queue,
+    exon_index,
     current_pos,
     current_transcript,
-    VCF_header,
+    variant_store,
     min_af,
-    tmp_dir,
     finalize,
 ):
+    # transcripts currently in the queue, accessed by the ID
+    queued_transcripts = {
+        transcript_entry["ID"]: transcript_entry for transcript_entry in transcript_queue
+    }
 
     # Process VCF lines
-    while (current_pos < current_transcript.start or finalize) and vcf_file_line != "":
-        REF, ALT = vcf_file_line.split(maxsplit=5)[3:5]
-        valid = check_vcf_line_validity(vcf_file_line, min_af, REF, ALT)
+    while (current_pos < current_transcript.start or finalize) and vcf_record is not None:
+        valid = check_vcf_line_validity(vcf_record, min_af)
 
         # check all transcripts in the queue
         if valid:
-            vcf_id = vcf_file_line.split(maxsplit=3)[2]
-            # print("vcf_file_line:", vcf_file_line[:50])
-            # print("vcf_id:", vcf_id)
-
-            if vcf_id == ".":
+            if vcf_record.id == ".":
                 # add an identifier = line count
-                vcf_file_line = (
-                    "\t".join(vcf_file_line.split(maxsplit=2)[:2])
-                    + "\t"
-                    + hex(vcf_linecount)[2:]
-                    + "\t"
-                    + vcf_file_line.split(maxsplit=3)[3]
+                vcf_record.id = hex(vcf_linecount)[2:]
+
+            # find the transcripts with an exon overlapping the reference allele, add the line to those in the queue that start at or before this position
+            overlapping_transcripts = [
+                transcript_id
+                for transcript_id in exon_index.overlapping(
+                    current_pos, current_pos + len(vcf_record.ref) - 1
                 )
-            # print("vcf_file_line2:", vcf_file_line[:50])
-            for transcript_entry in transcript_queue:
-
-                # check if the snp belongs to any of the exons
-                for exon in transcript_entry["exons"]:
-                    if exon.start < (current_pos + len(REF)):
-                        if exon.end >= current_pos:
-                            transcript_entry["file_content"] += vcf_file_line
-                            break
-                    else:
-                        break  # exon starts after the mutation -> continue to another transcript
+                if (transcript_id in queued_transcripts)
+                and (queued_transcripts[transcript_id]["start"] <= current_pos)
+            ]
+
+            # store the line only once, even if shared by multiple transcripts
+            if len(overlapping_transcripts) > 0:
+                row_idx = variant_store.add_record(vcf_record)
+                for transcript_id in overlapping_transcripts:
+                    variant_store.assign(transcript_id, row_idx)
 
         vcf_linecount += 1
-        try:
-            vcf_file_line = get_next_line(vcf_file)  # .readline()
-        except StopIteration:
-            vcf_file_line = ""
+        vcf_record = get_next_record(vcf_file, variant_store.tokenizer)
 
-        if vcf_file_line == "":
+        if vcf_record is None:
             break
 
-        current_pos = int(vcf_file_line.split(maxsplit=2)[1])
+        current_pos = vcf_record.pos
 
     # remove passed transcripts from queue
     while len(transcript_queue) > 0 and (
         transcript_queue[0]["end"] < current_pos or finalize
     ):
-        df = pd.read_csv(
-            StringIO(VCF_header + transcript_queue[0]["file_content"]), sep="\t"
-        )
-        df.to_csv(
-            tmp_dir + "/" + transcript_queue[0]["ID"] + ".tsv",
-            sep="\t",
-            index=False,
-            header=True,
-        )
-        # result_dfs[transcript_queue[0]['ID']] = df
         transcript_queue.pop(0)
 
     return (
-        VCF_header[:-1].split("\t"),
-        vcf_file_line,
+        vcf_record,
         vcf_linecount,
         transcript_queue,
         current_pos,
     )
 
 
-def get_next_line(file):
-    global global_list_of_lines
-    if len(global_list_of_lines) != 0:
-        return global_list_of_lines.pop(0)
-    else:
-        try:
-            line_original_vcf = next(file)
-            global_list_of_lines = preprocess_line(line_original_vcf)
-            global_list_of_lines = [g for g in global_list_of_lines if g != ""]
-            if len(global_list_of_lines) == 0:
-                return ""
-            return global_list_of_lines.pop(0)
-        except:
-            return ""
-
-
-def preprocess_line(line):
-    ALT = line.split(maxsplit=5)[4]
-    INFO = line.split(maxsplit=8)[7]
-
-    new_line = ""
-    if "," in ALT:
-        CHR = line.split(maxsplit=1)[0]
-        POS = line.split(maxsplit=1)[0]
-        ID = line.split(maxsplit=1)[0]
-        REF = line.split(maxsplit=1)[0]
-
-        for i, allele in enumerate(ALT.split(",")):
-            invalid_gts = list(range(1, 100))
-            invalid_gts.remove(i + 1)
-            GTs = line.split(maxsplit=9)[-1]
-            for gt_id in invalid_gts:
-                GTs = GTs.replace(str(gt_id) + "|", "0|")
-                GTs = GTs.replace("|" + str(gt_id), "|0")
-
-            GTs = GTs.replace(str(i + 1) + "|", "1|")
-            GTs = GTs.replace("|" + str(i + 1), "|1")
-
-            new_line += "\t".join(
-                line.split(maxsplit=4)[:-1] + [allele] + line.split(maxsplit=7)[5:-1]
-            )
-            new_line += "\tMAF=" + str(0.0) + "\tGT\t" + GTs
+# returns the next record in the VCF file, multi-allelic records are returned as one record per allele
+# returns None at the end of the file
+def get_next_record(file, tokenizer):
+    global global_list_of_records
+    while len(global_list_of_records) == 0:
+        line = next(file, b"")
+        if line == b"":
+            return None
+        global_list_of_records = preprocess_record(tokenizer.parse(line))
+
+    return global_list_of_records.pop(0)
+
+
+# split a multi-allelic record into one record for each alternative allele
+def preprocess_record(record):
+    ALT = record.alt
+
+    if "," not in ALT:
+        return [record]
 
-    else:
-        new_line = line
+    result = []
+    alleles = ALT.split(",")
+    allele_genotypes = split_genotypes(record.genotype_block, len(alleles))
 
-    return new_line.split("\n")
+    for i, allele in enumerate(alleles):
+        new_record = record.copy()
+        new_record.alt = allele
+        new_record.info = "MAF=" + str(0.0)
+        if "FORMAT" in record.tokenizer.positions:
+            new_record.set("FORMAT", "GT")
+        new_record.genotype_block = allele_genotypes[i]
+        result.append(new_record)
 
+    return result
 
-# Process a VCF file, select rows that intersect exons of given transcripts. Results are written as TSV files in to a temporary folder. Returns a list of column names in the VCF.
+
+# Process a VCF file, select rows that intersect exons of given transcripts. Returns a VariantStore holding the rows of every transcript (no columns if the VCF is empty).
+# A row is assigned to a transcript if its reference allele overlaps an exon of the transcript and its position is not before the start of the transcript
+# (rows starting in an intron and reaching into the following exon are included, rows starting before the first exon are not). The same rule is used by parse_vcf_indexed.
 # input:
-# all_transcripts: list of GTF transcript features, ordered by start position
+# all_transcripts: list of TranscriptModel objects, ordered by start position
 # vcf_file: file handle for reading the VCF
-# annotations_db: FeatureDB of the GTF file
 # min_af: threshold allele frequency (float)
-def parse_vcf(all_transcripts, vcf_file, annotations_db, min_af, tmp_dir):
+def parse_vcf(all_transcripts, vcf_file, min_af):
     if len(all_transcripts) == 0:
         raise RuntimeError("No transcript for this chromosome so this doesn't work")
     # read the header of the VCF - keep only the last line of the header
     VCF_header = ""
 
     vcf_linecount = 1
-    line = next(vcf_file)  # .readline()
+    line = next(vcf_file, b"")  # .readline()
 
-    while line != "" and line.startswith("#"):
-        VCF_header = line[1:]
+    while line != b"" and line.startswith(b"#"):
+        VCF_header = line[1:].decode()
         vcf_linecount += 1
-        line = next(vcf_file)  # vcf_file.readline()
+        line = next(vcf_file, b"")  # vcf_file.readline()
 
     # check if the VCF has any valid lines
-    if line == "":
-        return []
+    if line == b"":
+        return VariantStore([])
+
+    variant_store = VariantStore(VCF_header.rstrip("\r\n").split("\t"))
+
+    # the first entry -> split if multi-allelic
+    global global_list_of_records
+    global_list_of_records = preprocess_record(variant_store.tokenizer.parse(line))
+    vcf_record = global_list_of_records.pop(0)
 
     # browse the chromosome in a sweep-line approach - assumes that the VCF file is sorted!
     # keep a list of transcripts that intersect the current position of the sweep line -> assign the VCF line to all of these transcripts
 
     # TODO: get the coordinates within the transcript already here?
 
+    # index the exons of all the transcripts -> find transcripts overlapping a VCF entry with a single lookup
+    exon_index = ExonIndex(
+        [(transcript.id, transcript.exons) for transcript in all_transcripts]
+    )
+
     transcript_queue = (
         []
-    )  # queue of transcript objects inc. the exons, sorted by end position, each element aggregates the VCF file contents
-    current_pos = int(line.split()[1])  # position of the current VCF entry
+    )  # queue of transcript objects, sorted by end position
+    current_pos = vcf_record.pos  # position of the current VCF entry
     # result_dfs = {}                     # a list of dataframes with VCF entries for each transcript, accessed by the stable transcript id
 
     last_transcript = None
@@ -208,57 +197,131 @@ def parse_vcf(all_transcripts, vcf_file, annotations_db, min_af, tmp_dir):
             last_transcript.start < current_transcript.start
         ):
 
-            colnames, line, vcf_linecount, transcript_queue, current_pos = (
+            vcf_record, vcf_linecount, transcript_queue, current_pos = (
                 add_variants_to_transcripts(
-                    line,
+                    vcf_record,
                     vcf_file,
                     vcf_linecount,
                     transcript_queue,
+                    exon_index,
                     current_pos,
                     current_transcript,
-                    VCF_header,
+                    variant_store,
                     min_af,
-                    tmp_dir,
                     False,
                 )
             )
 
         # add the new transcript to the queue
-        exons = [
-            exon
-            for exon in annotations_db.children(
-                current_transcript, featuretype="exon", order_by="start"
-            )
-        ]
         queue_entry = {
             "transcript_obj": current_transcript,
             "ID": current_transcript.id,
-            "exons": exons,
             "start": current_transcript.start,
             "end": current_transcript.end,
-            "file_content": "",
         }
         nearest_idx = bisect.bisect_left(
             KeyWrapper(transcript_queue, key=lambda x: x["end"]), queue_entry["end"]
         )
         transcript_queue.insert(nearest_idx, queue_entry)
+        variant_store.add_transcript(current_transcript.id)
 
         last_transcript = current_transcript
 
     if len(all_transcripts) != 0:
-        colnames, line, vcf_linecount, transcript_queue, current_pos = (
+        vcf_record, vcf_linecount, transcript_queue, current_pos = (
             add_variants_to_transcripts(
-                line,
+                vcf_record,
                 vcf_file,
                 vcf_linecount,
                 transcript_queue,
+                exon_index,
                 current_pos,
                 current_transcript,
-                VCF_header,
+                variant_store,
                 min_af,
-                tmp_dir,
                 True,
             )
         )
 
-    return colnames
+    return variant_store
+
+
+# Same as parse_vcf, but reads only the regions covered by exons of the given transcripts, returns a VariantStore.
+# Requires a bgzip-compressed VCF with a tabix index (.tbi or .csi) next to it.
+# The VCF does not need to be browsed from the start, so the running time depends only on the size of the covered regions.
+# Line numbers are not known in this mode -> VCF entries without an ID are identified by the position (hex) and the index of the allele.
+# Rows are assigned to transcripts by the same rule as in parse_vcf: the reference allele overlaps an exon, and the position is not before the start of the transcript.
+# input:
+# all_transcripts: list of TranscriptModel objects, ordered by start position
+# vcf_filename: path to the indexed VCF
+# min_af: threshold allele frequency (float)
+def parse_vcf_indexed(all_transcripts, vcf_filename, min_af):
+    if len(all_transcripts) == 0:
+        raise RuntimeError("No transcript for this chromosome so this doesn't work")
+
+    vcf_file = pysam.TabixFile(vcf_filename)
+
+    # check if the VCF has any valid lines
+    if len(vcf_file.contigs) == 0:
+        vcf_file.close()
+        return VariantStore([])
+
+    # keep only the last line of the header
+    variant_store = VariantStore(vcf_file.header[-1][1:].split("\t"))
+    tokenizer = variant_store.tokenizer
+
+    stored_rows = {}  # fixed columns of VCF lines already stored -> row indices in the store, lines shared by multiple transcripts are stored once
+
+    for transcript in all_transcripts:
+        variant_store.add_transcript(transcript.id)
+
+        # chromosome names can be given with or without the "chr" prefix
+        contig = transcript.chrom
+        if contig not in vcf_file.contigs:
+            if ("chr" + contig) in vcf_file.contigs:
+                contig = "chr" + contig
+            elif contig.replace("chr", "", 1) in vcf_file.contigs:
+                contig = contig.replace("chr", "", 1)
+            else:
+                continue
+
+        exons = transcript.exons
+
+        visited_lines = set()  # a VCF line reaching over an intron is returned for both exons -> add it only once
+
+        for exon in exons:
+            # the index takes into account the length of the reference allele, i.e., VCF lines starting before the exon are included if they reach into it
+            for vcf_line in vcf_file.fetch(contig, exon.start - 1, exon.end):
+                line_key = tuple(vcf_line.split("\t", 8)[:8])
+                if line_key in visited_lines:
+                    continue
+
+                # the index also returns lines starting before the first exon and reaching into it -> not part of the transcript (same as in parse_vcf)
+                if int(line_key[1]) < transcript.start:
+                    continue
+                visited_lines.add(line_key)
+
+                if line_key in stored_rows:
+                    for row_idx in stored_rows[line_key]:
+                        variant_store.assign(transcript.id, row_idx)
+                    continue
+
+                stored_rows[line_key] = []
+
+                for allele_idx, vcf_record in enumerate(
+                    preprocess_record(tokenizer.parse(vcf_line.encode()))
+                ):
+                    if not check_vcf_line_validity(vcf_record, min_af):
+                        continue
+
+                    if vcf_record.id == ".":
+                        # add an identifier = position and allele index
+                        vcf_record.id = hex(vcf_record.pos)[2:] + "_" + str(allele_idx)
+
+                    row_idx = variant_store.add_record(vcf_record)
+                    variant_store.assign(transcript.id, row_idx)
+                    stored_rows[line_key].append(row_idx)
+
+    vcf_file.close()
+
+    return variant_store
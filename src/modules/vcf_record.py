@@ -0,0 +1,126 @@
+VCF_FIXED_COLUMNS = [
+    "CHROM",
+    "POS",
+    "ID",
+    "REF",
+    "ALT",
+    "QUAL",
+    "FILTER",
+    "INFO",
+    "FORMAT",
+]
+
+
+# Splits VCF lines (bytes) into records. The layout of the columns is taken from the header,
+# so that files with a reduced set of columns (e.g., CHROM, POS, ID, REF, ALT, INFO) are supported as well.
+class VCFTokenizer:
+    # columns: column names from the last line of the VCF header (without the leading '#')
+    def __init__(self, columns):
+        self.columns = columns
+
+        # fixed columns come first, all the following columns are samples
+        self.fixed_count = 0
+        while (
+            self.fixed_count < len(columns)
+            and columns[self.fixed_count] in VCF_FIXED_COLUMNS
+        ):
+            self.fixed_count += 1
+
+        self.fixed_columns = columns[: self.fixed_count]
+        self.samples = columns[self.fixed_count :]
+        self.positions = {colname: i for i, colname in enumerate(self.fixed_columns)}
+
+    @classmethod
+    def from_header_line(cls, header_line):
+        if isinstance(header_line, bytes):
+            header_line = header_line.decode()
+        return cls(header_line.rstrip("\r\n").lstrip("#").split("\t"))
+
+    # split the line once, the genotypes are kept as a single undecoded block
+    def parse(self, line):
+        fields = line.rstrip(b"\r\n").split(b"\t", self.fixed_count)
+
+        genotype_block = b""
+        if len(fields) > self.fixed_count:
+            genotype_block = fields.pop()
+
+        return VCFRecord([field.decode() for field in fields], genotype_block, self)
+
+
+# A single VCF entry. The fixed columns are decoded, the genotypes are decoded only when requested.
+class VCFRecord:
+    __slots__ = ("fields", "genotype_block", "tokenizer")
+
+    def __init__(self, fields, genotype_block, tokenizer):
+        self.fields = fields  # values of the fixed columns, in the order of the header
+        self.genotype_block = genotype_block  # tab-separated genotypes of all samples (bytes)
+        self.tokenizer = tokenizer
+
+    def get(self, colname, default="."):
+        idx = self.tokenizer.positions.get(colname)
+        if idx is None or idx >= len(self.fields):
+            return default
+        return self.fields[idx]
+
+    def set(self, colname, value):
+        idx = self.tokenizer.positions.get(colname)
+        if idx is not None:
+            self.fields[idx] = value
+
+    @property
+    def chrom(self):
+        return self.get("CHROM")
+
+    @property
+    def pos(self):
+        return int(self.get("POS"))
+
+    @property
+    def id(self):
+        return self.get("ID")
+
+    @id.setter
+    def id(self, value):
+        self.set("ID", value)
+
+    @property
+    def ref(self):
+        return self.get("REF")
+
+    @property
+    def alt(self):
+        return self.get("ALT")
+
+    @alt.setter
+    def alt(self, value):
+        self.set("ALT", value)
+
+    @property
+    def info(self):
+        return self.get("INFO")
+
+    @info.setter
+    def info(self, value):
+        self.set("INFO", value)
+
+    # returns the value of a field in the INFO column (e.g., AF), None if not present
+    def info_value(self, key):
+        for entry in self.info.split(";"):
+            if entry.startswith(key + "="):
+                return entry[len(key) + 1 :]
+        return None
+
+    # returns the list of genotypes (e.g., '0|1'), in the order of samples in the header
+    def genotypes(self):
+        return self.genotype_block.decode().split("\t")
+
+    def copy(self):
+        return VCFRecord(list(self.fields), self.genotype_block, self.tokenizer)
+
+    def to_line(self):
+        if len(self.genotype_block) > 0:
+            return (
+                "\t".join(self.fields) + "\t" + self.genotype_block.decode() + "\n"
+            )
+        return "\t".join(self.fields) + "\n"
+
@@ -11,10 +11,13 @@ import os
 from numpy import int64
 import pandas as pd
 
-from modules.vcf_reader import parse_vcf
-from modules.common import read_fasta
-from modules.get_haplotypes import get_gene_haplotypes
+from modules.vcf_reader import parse_vcf, parse_vcf_indexed
+from modules.fasta_index import IndexedFasta
+from modules.annotations import prefetch_transcripts
+from modules.variant_store import VariantStore
+from modules.get_haplotypes import get_gene_haplotypes, format_haplotypes
 from modules.process_haplotypes import process_haplotypes, empty_output
+from modules.consequence_cache import ConsequenceCache
 
 parser = argparse.ArgumentParser(
     description="Creates a database of CDS + protein haplotypes, and a fasta file of protein haplotype sequences."
@@ -25,18 +28,35 @@ def is_valid_file(parser, arg):
     if not os.path.exists(arg):
         parser.error("The file %s does not exist!" % arg)
     else:
-        return gzip.open(arg, "rt")  # open(arg, "r")  # return an open file handle
+        return gzip.open(arg, "rb")  # open(arg, "rb")  # return an open file handle
 
 
 parser.add_argument(
     "-i",
     dest="input_vcf",
-    required=True,
-    help="input VCF file",
+    required=False,
+    help="input VCF file (required unless -genotypes is given)",
     metavar="FILE",
     type=lambda x: is_valid_file(parser, x),
 )
 
+parser.add_argument(
+    "-use_index",
+    dest="use_index",
+    required=False,
+    type=int,
+    help="flag (0 or 1): read only the regions covered by the transcripts using the tabix index (.tbi or .csi) of the bgzip-compressed VCF; default: 0",
+    default=0,
+)
+
+parser.add_argument(
+    "-genotypes",
+    dest="genotypes_prefix",
+    required=False,
+    help="prefix of the genotype matrix files created by vcf_genotype_matrix.py, used instead of the input VCF file",
+    default=None,
+)
+
 parser.add_argument(
     "-db",
     dest="annotation_db",
@@ -99,6 +119,23 @@ parser.add_argument(
     default=1,
 )
 
+parser.add_argument(
+    "-export_cdna",
+    dest="export_cdna",
+    required=False,
+    type=int,
+    help="flag (0 or 1): export the mutated cDNA sequences of all haplotypes into cDNA_res/<chromosome>.fa.gz in the results folder; default: 1",
+    default=1,
+)
+
+parser.add_argument(
+    "-consequence_cache",
+    dest="consequence_cache",
+    required=False,
+    help="SQLite file caching the effects of variants on the cDNA, shared with ProVar and reused between runs; default: none",
+    default="",
+)
+
 parser.add_argument(
     "-force_rf",
     dest="force_rf",
@@ -191,14 +228,6 @@ parser.add_argument(
     default="prohap.log",
 )
 
-parser.add_argument(
-    "-tmp_dir",
-    dest="tmp_dir",
-    required=False,
-    help="directory for temporary files; default: tmp",
-    default="tmp",
-)
-
 parser.add_argument(
     "-output_csv", dest="output_file", required=True, help="output CSV file"
 )
@@ -209,7 +238,13 @@ parser.add_argument(
 
 args = parser.parse_args()
 
-print("[ProHap] Computing protein haplotypes from", args.input_vcf.name)
+if (args.input_vcf is None) and (args.genotypes_prefix is None):
+    parser.error("either the input VCF file (-i) or the genotype matrix (-genotypes) is required")
+
+if args.genotypes_prefix is not None:
+    print("[ProHap] Computing protein haplotypes from", args.genotypes_prefix + ".npy")
+else:
+    print("[ProHap] Computing protein haplotypes from", args.input_vcf.name)
 
 print(("Chr " + args.chromosome + ":"), "Reading", args.annotation_db)
 # Load the annotations database
@@ -231,26 +266,21 @@ samples_df = pd.read_csv(args.samples_filename, sep="\t")
 
 print(("Chr " + args.chromosome + ":"), "Assigning annotations to transcripts.")
 
-# create a list of transcript features from the annotation db
+# read the annotation of all the transcripts at once: exons, start and stop codons, biotype
+transcript_models = prefetch_transcripts(annotations_db, transcript_list)
+
+# create a list of transcript models
 all_transcripts = []
 for transcript_id in transcript_list:
-    try:
-        feature = annotations_db[transcript_id]
-    except Exception as e:
-        print(e)
+    if transcript_id not in transcript_models:
         print(
             f"Transcript {transcript_id} not found in this chromosome verify that it is present in the gtf"
         )
         print("Maybe raise error here?")
         continue
+    feature = transcript_models[transcript_id]
     if args.require_start:  # start codon annotation is required - check if present
-        start_codons = [
-            sc
-            for sc in annotations_db.children(
-                feature, featuretype="start_codon", order_by="start"
-            )
-        ]  # there should be only one, but just in case...
-        if len(start_codons) > 0:
+        if feature.start_codon is not None:
             all_transcripts.append(feature)
         else:
             fichier = open("not_found_transcript.txt", "a")
@@ -262,10 +292,18 @@ all_transcripts.sort(key=lambda x: x.start)
 transcript_list = [feature.id for feature in all_transcripts]
 
 print(("Chr " + args.chromosome + ":"), "Assigning variants to transcripts.")
-# parse the VCF file, get a dataframe of variants for each transcript
-vcf_colnames = parse_vcf(
-    all_transcripts, args.input_vcf, annotations_db, args.min_af, args.tmp_dir
-)
+# parse the VCF file, get the variants for each transcript
+if args.genotypes_prefix is not None:
+    variant_store = VariantStore.load(args.genotypes_prefix)
+elif args.use_index:
+    variant_store = parse_vcf_indexed(
+        all_transcripts, args.input_vcf.name, args.min_af
+    )
+else:
+    variant_store = parse_vcf(
+        all_transcripts, args.input_vcf, args.min_af
+    )
+vcf_colnames = variant_store.columns
 
 # keep only the samples that are in the metadata table
 sample_ids = [
@@ -282,10 +320,10 @@ if len(vcf_colnames) == 0:
 else:
     print(("Chr " + args.chromosome + ":"), "Computing the co-occurrence of alleles.")
     # check co-occurence of alleles -> get the haplotypes for all transcripts
-    gene_haplo_df = get_gene_haplotypes(
+    gene_haplo_df, haplotype_variants = get_gene_haplotypes(
         all_transcripts,
         sample_ids,
-        args.tmp_dir,
+        variant_store,
         args.log_file,
         args.threads,
         (args.chromosome == "X"),
@@ -298,27 +336,27 @@ else:
     haplo_folder = folder_res + "/gene_haplo/"
     if not os.path.exists(haplo_folder):
         os.mkdir(haplo_folder)
-    gene_haplo_df.to_csv(
+    format_haplotypes(gene_haplo_df, haplotype_variants).to_csv(
         haplo_folder + "/gene_haplo_chr_" + args.chromosome + "_df.csv"
     )
-    # remove the temporary files
-    # for transcript_id in transcript_list:
-    #     os.remove(args.tmp_dir + "/" + transcript_id + ".tsv")
-
     # filter the haplotypes by FoO -> CHANGE: filter only after processing, some haplotypes can be merged
     # gene_haplo_df = gene_haplo_df[gene_haplo_df['Frequency'] >= args.min_foo]
 
     # read the CDS sequence file
     print(("Chr " + args.chromosome + ":"), "Reading", args.cdnas_fasta)
-    all_cds = read_fasta(args.cdnas_fasta, True)
+    all_cds = IndexedFasta(args.cdnas_fasta, True)
+
+    consequence_cache = None
+    if args.consequence_cache != "":
+        consequence_cache = ConsequenceCache(args.consequence_cache)
 
     # align the variant coordinates to transcript, translate into the protein database
     print(("Chr " + args.chromosome + ":"), "Creating haplotype database.")
     haplo_results = process_haplotypes(
         all_transcripts,
         gene_haplo_df,
+        haplotype_variants,
         all_cds,
-        annotations_db,
         args.chromosome,
         args.haplo_id_prefix,
         args.force_rf,
@@ -328,6 +366,8 @@ else:
         args.min_hap_count,
         args.ignore_UTR,
         args.skip_start_lost,
+        args.export_cdna,
+        consequence_cache,
     )
     result_data = haplo_results[0]
     result_sequences = haplo_results[1]
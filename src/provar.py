@@ -4,9 +4,11 @@ import os
 import pandas as pd
 from datetime import datetime
 
-from modules.vcf_reader import parse_vcf
-from modules.common import read_fasta
+from modules.vcf_reader import parse_vcf, parse_vcf_indexed
+from modules.fasta_index import IndexedFasta
+from modules.annotations import prefetch_transcripts
 from modules.process_variants import process_store_variants, empty_output
+from modules.consequence_cache import ConsequenceCache
 
 parser = argparse.ArgumentParser(
         description='Creates a database and a FASTA file of variant protein sequences given a VCF file')
@@ -15,12 +17,15 @@ def is_valid_file(parser, arg):
         if not os.path.exists(arg):
                 parser.error("The file %s does not exist!" % arg)
         else:
-                return open(arg, 'r')  # return an open file handle
+                return open(arg, 'rb')  # return an open file handle
 
 parser.add_argument("-i", dest="input_vcf", required=True,
                     help="input VCF file", metavar="FILE",
                     type=lambda x: is_valid_file(parser, x))
 
+parser.add_argument("-use_index", dest="use_index", required=False, type=int,
+                    help="flag (0 or 1): read only the regions covered by the transcripts using the tabix index (.tbi or .csi) of the bgzip-compressed VCF; default: 0", default=0)
+
 parser.add_argument("-db", dest="annotation_db", required=True,
                     help="DB file created by gffutils from GTF")
 
@@ -48,12 +53,15 @@ parser.add_argument("-tag", dest="fasta_tag", required=False,
 parser.add_argument("-acc_prefix", dest="accession_prefix", required=False,
                     help="prefix for FASTA file entries accession", default='var')
 
+parser.add_argument("-threads", dest="threads", required=False, type=int,
+                    help="number of threads to use; default: 1", default=1)
+
+parser.add_argument("-consequence_cache", dest="consequence_cache", required=False,
+                    help="SQLite file caching the effects of variants on the cDNA, shared with ProHap and reused between runs; default: none", default='')
+
 parser.add_argument("-log", dest="log_file", required=False,
                     help="output log file", default="provar.log")
 
-parser.add_argument("-tmp_dir", dest="tmp_dir", required=False,
-                    help="directory for temporary files", default="tmp")
-
 parser.add_argument("-output_csv", dest="output_file", required=True,
                     help="output CSV file")
 
@@ -76,14 +84,16 @@ transcript_list = transcript_df[transcript_df['chromosome'] == args.chromosome][
 
 print (('Chr ' + args.chromosome + ':'), 'Assigning annotations to transcripts.')
 
-# create a list of transcript features from the annotation db
+# read the annotation of all the transcripts at once: exons, start and stop codons, biotype
+transcript_models = prefetch_transcripts(annotations_db, transcript_list)
+
+# create a list of transcript models
 all_transcripts = []
 
 for transcript_id in transcript_list:
-    feature = annotations_db[transcript_id]
+    feature = transcript_models[transcript_id]
     if (args.require_start):
-        start_codons = [ sc for sc in annotations_db.children(feature, featuretype='start_codon', order_by='start') ]    # there should be only one, but just in case...
-        if (len(start_codons) > 0):
+        if (feature.start_codon is not None):
                 all_transcripts.append(feature)
     else:
         all_transcripts.append(feature)
@@ -92,8 +102,12 @@ all_transcripts.sort(key=lambda x: x.start)
 transcript_list = [ feature.id for feature in all_transcripts ]
 
 print (('Chr ' + args.chromosome + ':'), 'Assigning variants to transcripts.')
-# parse the VCF file, get a dataframe of variants for each transcript
-vcf_columns = parse_vcf(all_transcripts, args.input_vcf, annotations_db, args.min_af, args.tmp_dir)
+# parse the VCF file, get the variants for each transcript
+if (args.use_index):
+        variant_store = parse_vcf_indexed(all_transcripts, args.input_vcf.name, args.min_af)
+else:
+        variant_store = parse_vcf(all_transcripts, args.input_vcf, args.min_af)
+vcf_columns = variant_store.columns
 
 # check if the vcf file was empty
 if (len(vcf_columns) == 0):
@@ -102,19 +116,19 @@ if (len(vcf_columns) == 0):
 else:
         # read the CDS sequence file
         print (('Chr ' + args.chromosome + ':'), "Reading", args.cdnas_fasta)
-        all_cds = read_fasta(args.cdnas_fasta, True)
+        all_cds = IndexedFasta(args.cdnas_fasta, True)
 
         log_file = open(args.log_file, 'a')
         log_file.write('------------' + '[' + datetime.now().strftime('%X %x') + '] Chr ' + args.chromosome + ':' + '------------\n')
 
+        consequence_cache = None
+        if (args.consequence_cache != ''):
+                consequence_cache = ConsequenceCache(args.consequence_cache)
+
         print (('Chr ' + args.chromosome + ':'), 'Creating variant database.')
         # align the variant coordinates to transcript, translate into the protein database
-        process_store_variants(all_transcripts, args.tmp_dir, log_file, all_cds, annotations_db, args.chromosome, args.fasta_tag, args.accession_prefix, args.force_rf, args.output_file, args.output_fasta)
+        process_store_variants(all_transcripts, variant_store, log_file, all_cds, args.chromosome, args.fasta_tag, args.accession_prefix, args.force_rf, args.output_file, args.output_fasta, args.threads, consequence_cache)
 
         log_file.close()
 
-        # remove the temporary files
-        for transcript_id in transcript_list:
-                os.remove(args.tmp_dir + '/' + transcript_id + '.tsv')
-
         print('Done.')
@@ -1,6 +1,7 @@
 import argparse
 import os.path
 import re
+from modules.common import iter_fasta
 
 
 parser = argparse.ArgumentParser(
@@ -12,7 +13,7 @@ def is_valid_file(parser, arg):
     if not os.path.exists(arg):
         parser.error("The file %s does not exist!" % arg)
     else:
-        return open(arg, "r")  # return an open file handle
+        return open(arg, "rb")  # return an open file handle
 
 
 parser.add_argument(
@@ -48,15 +49,7 @@ print("")
 print("Reading file", args.input_file.name)
 print("Removing stop codons (*).")
 
-metadata = args.input_file.readline()  # line starting with '>'
-sequence = ""  # all the other lines are considered protein sequences (considering also a multi-line format)
-
-while metadata != "":
-
-    line = args.input_file.readline()
-    while not line.startswith(">") and not line == "":
-        sequence += line[:-1]
-        line = args.input_file.readline()
+for metadata, sequence in iter_fasta(args.input_file):
 
     tag, accession, description = metadata.split("|")
 
@@ -142,9 +135,6 @@ while metadata != "":
         else:
             args.output_file.write(sequence + "\n")
 
-    metadata = line
-    sequence = ""
-
 args.output_file.close()
 args.input_file.close()
 print("Done")
@@ -1,5 +1,7 @@
 import argparse
 import gzip
+from modules.vcf_record import VCFTokenizer
+from modules.genotypes import split_genotypes
 
 parser = argparse.ArgumentParser(
     description="Reads the VCF file, parses multi-allelic variants into multiple lines, and filters out variants under the MAF threshold."
@@ -37,78 +39,72 @@ parser.add_argument("-o", dest="output_file", required=True, help="output VCF")
 args = parser.parse_args()
 
 
-def get_MAF(info):
-    if ";" + args.af_field + "=" in info:
-        return info.split(";" + args.af_field + "=")[1].split(";")[0]
-    elif "\t" + args.af_field + "=" in info:
-        return info.split("\t" + args.af_field + "=")[1].split(";")[0]
+def get_MAF(record):
+    MAF = record.info_value(args.af_field)
+    if MAF is None:
+        return "-1"
 
-    return "-1"
+    return MAF
 
 
 # read the header of the VCF - keep only the last line of the header
 VCF_header = ""
 
-vcf_file = gzip.open(args.input_file, "rt")  # open(args.input_file, 'r')
+vcf_file = gzip.open(args.input_file, "rb")  # open(args.input_file, 'rb')
 outfile = open(args.output_file, "w")
 
-line = next(vcf_file)  # .readline()
+line = next(vcf_file, b"")  # .readline()
+header_line = b""
 
-while line != "" and line.startswith("#"):
-    VCF_header += line
-    line = next(vcf_file)  # .readline()
+while line != b"" and line.startswith(b"#"):
+    VCF_header += line.decode()
+    header_line = line
+    line = next(vcf_file, b"")  # .readline()
 
 outfile.write(VCF_header)
 
 # check if the VCF has any valid lines
-if line == "":
+if line == b"":
     outfile.close()
     vcf_file.close()
     print("VCF file is empty!")
     exit()
 
+tokenizer = VCFTokenizer.from_header_line(header_line)
+
 total_VCF_entries = 0
 valid_VCF_entries = 0
 
-while line != "":
-    ALT = line.split(maxsplit=5)[4]
-    INFO = line.split(maxsplit=8)[7]
-    MAF = get_MAF(INFO)
+while line != b"":
+    # split the line only once
+    record = tokenizer.parse(line)
+    ALT = record.alt
+    MAF = get_MAF(record)
     total_VCF_entries += 1
 
     new_line = ""
     if "," in ALT:
-        CHR = line.split(maxsplit=1)[0]
-        POS = line.split(maxsplit=1)[0]
-        ID = line.split(maxsplit=1)[0]
-        REF = line.split(maxsplit=1)[0]
-
-        for i, allele in enumerate(ALT.split(",")):
+        alleles = ALT.split(",")
+        allele_genotypes = None  # decoded only if at least one allele passes the threshold
+        for i, allele in enumerate(alleles):
             allele_maf = float(MAF.split(",")[i])
 
             if allele_maf >= args.min_af:
-                invalid_gts = list(range(1, 100))
-                invalid_gts.remove(i + 1)
-                GTs = line.split(maxsplit=9)[-1]
-                for gt_id in invalid_gts:
-                    GTs = GTs.replace(str(gt_id) + "|", "0|")
-                    GTs = GTs.replace("|" + str(gt_id), "|0")
-
-                GTs = GTs.replace(str(i + 1) + "|", "1|")
-                GTs = GTs.replace("|" + str(i + 1), "|1")
-
-                new_line += "\t".join(
-                    line.split(maxsplit=4)[:-1]
-                    + [allele]
-                    + line.split(maxsplit=7)[5:-1]
-                )
-                new_line += "\tMAF=" + str(allele_maf) + "\tGT\t" + GTs
+                new_record = record.copy()
+                new_record.alt = allele
+                new_record.info = "MAF=" + str(allele_maf)
+                new_record.set("FORMAT", "GT")
+                if allele_genotypes is None:
+                    allele_genotypes = split_genotypes(record.genotype_block, len(alleles))
+                new_record.genotype_block = allele_genotypes[i]
+
+                new_line += new_record.to_line()
                 valid_VCF_entries += 1
 
     else:
         allele_maf = float(MAF)
         if allele_maf >= args.min_af:
-            new_line = line
+            new_line = line.decode()
             valid_VCF_entries += 1
 
     outfile.write(new_line)
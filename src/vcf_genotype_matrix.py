@@ -0,0 +1,116 @@
+"""
+Converts a phased VCF file of a single chromosome into a genotype matrix for ProHap
+
+Keeps the VCF entries overlapping exons of the given transcripts. Writes a uint8 matrix of shape (variants, samples, 2) in the .npy format,
+and tables of the variant metadata and transcript assignments. ProHap reads these files (-genotypes) as a memory-mapped matrix
+instead of parsing the VCF, so that it can be rerun with different sample sets or thresholds.
+"""
+
+import gzip
+import gffutils
+import argparse
+import pandas as pd
+
+from modules.vcf_reader import parse_vcf, parse_vcf_indexed
+from modules.annotations import prefetch_transcripts
+
+parser = argparse.ArgumentParser(
+    description="Converts a phased VCF file into a genotype matrix and a table of variants assigned to transcripts."
+)
+
+parser.add_argument(
+    "-i", dest="input_vcf", required=True, help="input VCF file", metavar="FILE"
+)
+
+parser.add_argument(
+    "-use_index",
+    dest="use_index",
+    required=False,
+    type=int,
+    help="flag (0 or 1): read only the regions covered by the transcripts using the tabix index (.tbi or .csi) of the bgzip-compressed VCF; default: 0",
+    default=0,
+)
+
+parser.add_argument(
+    "-db",
+    dest="annotation_db",
+    required=True,
+    help="DB file created by gffutils from GTF",
+)
+
+parser.add_argument(
+    "-transcripts",
+    dest="transcript_list",
+    required=True,
+    help="list of transcript IDs, provided in a CSV file",
+    metavar="FILE",
+)
+
+parser.add_argument(
+    "-chr",
+    dest="chromosome",
+    required=True,
+    help="chromosome being processed (e.g., 1, 12 or X)",
+)
+
+parser.add_argument(
+    "-af",
+    dest="min_af",
+    required=False,
+    type=float,
+    help="Allele Frequency (AF) lower threshold - default 0",
+    default=0,
+)
+
+parser.add_argument(
+    "-o",
+    dest="output_prefix",
+    required=True,
+    help="output file prefix: creates <prefix>.npy, <prefix>_columns.txt, <prefix>_variants.tsv and <prefix>_transcripts.tsv",
+)
+
+args = parser.parse_args()
+
+print(("Chr " + args.chromosome + ":"), "Reading", args.annotation_db)
+annotations_db = gffutils.FeatureDB(args.annotation_db)
+
+print(("Chr " + args.chromosome + ":"), "Reading", args.transcript_list)
+transcript_df = pd.read_csv(args.transcript_list)
+transcript_df["chromosome"] = transcript_df["chromosome"].apply(lambda x: str(x))
+transcript_list = transcript_df[transcript_df["chromosome"] == args.chromosome][
+    "transcriptID"
+].tolist()
+
+# all the transcripts found in the annotation, start codon annotation is checked later by ProHap
+transcript_models = prefetch_transcripts(annotations_db, transcript_list)
+all_transcripts = []
+for transcript_id in transcript_list:
+    if transcript_id in transcript_models:
+        all_transcripts.append(transcript_models[transcript_id])
+    else:
+        print(("Chr " + args.chromosome + ":"), "Transcript", transcript_id, "not found in the annotation")
+all_transcripts.sort(key=lambda x: x.start)
+
+print(("Chr " + args.chromosome + ":"), "Reading", args.input_vcf)
+if args.use_index:
+    variant_store = parse_vcf_indexed(
+        all_transcripts, args.input_vcf, args.min_af
+    )
+else:
+    if args.input_vcf.endswith(".gz"):
+        vcf_file = gzip.open(args.input_vcf, "rb")
+    else:
+        vcf_file = open(args.input_vcf, "rb")
+    variant_store = parse_vcf(all_transcripts, vcf_file, args.min_af)
+    vcf_file.close()
+
+print(
+    ("Chr " + args.chromosome + ":"),
+    "Writing",
+    len(variant_store),
+    "variants x",
+    len(variant_store.samples),
+    "samples:",
+    args.output_prefix + ".npy",
+)
+variant_store.save(args.output_prefix)